@@ -0,0 +1,2441 @@
+# Copyright (c) 2016 Janek Bevendorff
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Qt-independent data core: input readers, column storage, statistics and scaling of relations.
+This module only depends on NumPy, so it can be used in scripts and worker processes without loading Qt.
+The Qt adapter with change notification signals is L{data.Relation}.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event
+from abc import abstractmethod
+import itertools
+import json
+import queue
+import bz2
+import csv
+import functools
+import gzip
+import lzma
+import math
+import numpy as np
+import os
+import re
+import tempfile
+import warnings
+import zipfile
+
+
+# spellings of missing values in text files
+missingValues = ("?", "")
+
+
+def missingCode(dtype):
+    """
+    @return: code marking missing values in nominal columns of the given unsigned integer type
+    """
+    return np.iinfo(dtype).max
+
+
+def parseFloats(values, dtype=np.float64):
+    """
+    Convert a sequence of strings to a float array in bulk. Missing values (see L{missingValues})
+    become NaN, only sequences containing them take the slower per-value path.
+
+    @param values: sequence of strings
+    @param dtype: float type of the result
+    @return: NumPy array
+    """
+    try:
+        return np.array(values, dtype=dtype)
+    except ValueError:
+        return np.array([np.nan if v.strip() in missingValues else v for v in values], dtype=dtype)
+
+
+def byteField(strings):
+    """
+    Byte field of a byte string array for L{joinColumns}.
+
+    @param strings: NumPy byte string array ("S" dtype)
+    @return: tuple of uint8 matrix with the bytes of each string in a row and boolean mask of the used bytes
+    """
+    strings = np.ascontiguousarray(strings)
+    width = strings.dtype.itemsize
+    return strings.view(np.uint8).reshape(len(strings), width), np.arange(width) < np.char.str_len(strings)[:, None]
+
+
+def formatFloats(values, missing=b"", maxDecimals=6):
+    """
+    Format a float array as byte field for L{joinColumns}, whose strings are parsed back to exactly the same values.
+    Values with at most maxDecimals decimal places are formatted by vectorized integer arithmetic,
+    only the others take the much slower shortest round-trip conversion of NumPy.
+
+    @param values: 1D float array
+    @param missing: bytes written for missing values (NaN)
+    @param maxDecimals: maximum number of decimal places formatted by integer arithmetic
+    @return: tuple of uint8 matrix with the characters of each value in a row and boolean mask of the used bytes
+    """
+    dtype = values.dtype
+    # integers below this limit and powers of ten up to maxDecimals are exact in the float type
+    limit = 2.0 ** (np.finfo(dtype).nmant + 1)
+    isMissing = np.isnan(values)
+    remaining = np.isfinite(values)
+    parts = []
+    for decimals in range(maxDecimals + 1):
+        rows = np.flatnonzero(remaining)
+        if not len(rows):
+            break
+        # m / 10^decimals is the correctly rounded value of the decimal string, so it has to match exactly
+        scale = dtype.type(10 ** decimals)
+        m = np.rint(values[rows] * scale)
+        exact = (np.abs(m) < limit) & (m / scale == values[rows])
+        rows = rows[exact]
+        remaining[rows] = False
+        if not len(rows):
+            continue
+
+        m = m[exact].astype(np.int64)
+        a = np.abs(m)
+        numDigits = max(len(str(int(a.max()))), decimals + 1)
+        digits = (a[:, None] // 10 ** np.arange(numDigits - 1, -1, -1, dtype=np.int64)) % 10 + ord("0")
+        length = np.where(a > 0, numDigits - np.argmax(digits != ord("0"), axis=1), 1)
+        length = np.maximum(length, decimals + 1)
+
+        # sign, integer digits, decimal point and decimal digits
+        intDigits = numDigits - decimals
+        cells = np.empty((len(rows), numDigits + 2), dtype=np.uint8)
+        cells[:, 0] = ord("-")
+        cells[:, 1:intDigits + 1] = digits[:, :intDigits]
+        cells[:, intDigits + 1] = ord(".")
+        cells[:, intDigits + 2:] = digits[:, intDigits:]
+        valid = np.zeros(cells.shape, dtype=bool)
+        valid[:, 0] = m < 0
+        valid[:, 1:intDigits + 1] = np.arange(intDigits) >= (numDigits - length)[:, None]
+        valid[:, intDigits + 1:] = decimals > 0
+        parts.append((rows, cells, valid))
+
+    rows = np.flatnonzero(remaining | np.isinf(values) | isMissing)
+    if len(rows):
+        parts.append((rows,) + byteField(np.where(isMissing[rows], missing, values[rows].astype("S"))))
+
+    width = max([p[1].shape[1] for p in parts] + [1])
+    chars = np.zeros((len(values), width), dtype=np.uint8)
+    valid = np.zeros((len(values), width), dtype=bool)
+    for rows, c, v in parts:
+        chars[rows, :c.shape[1]] = c
+        valid[rows, :c.shape[1]] = v
+    return chars, valid
+
+
+def codeType(numValues):
+    """
+    Smallest unsigned integer type for storing codes of a nominal attribute.
+    The largest value of the type is reserved as a marker for missing values.
+
+    @param numValues: number of distinct values of the attribute
+    @return: NumPy dtype
+    """
+    for t in (np.uint8, np.uint16, np.uint32):
+        if numValues < np.iinfo(t).max:
+            return np.dtype(t)
+    return np.dtype(np.uint64)
+
+
+# one ARFF value: single or double quoted with backslash escapes, or unquoted up to the next comma
+arffValuePattern = re.compile(r"""\s*('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[^,]*?)\s*(,|$)""")
+
+
+def unquoteArff(value):
+    """
+    Remove the quotes and backslash escapes of a quoted ARFF name or value.
+
+    @param value: string, returned unchanged if it is not quoted
+    @return: unquoted string
+    """
+    if len(value) > 1 and value[0] in "'\"" and value[-1] == value[0]:
+        return re.sub(r"\\(.)", r"\1", value[1:-1])
+    return value
+
+
+def splitArffValues(text):
+    """
+    Split a comma separated list of ARFF values, commas within quoted values do not separate values.
+    Lines without quotes are split without parsing them.
+
+    @param text: data line or list of nominal values
+    @return: list of unquoted values
+    """
+    if "'" not in text and '"' not in text:
+        return text.split(",")
+    values = []
+    pos = 0
+    while True:
+        m = arffValuePattern.match(text, pos)
+        if m is None:
+            raise ValueError("Invalid quoted value: " + text)
+        values.append(unquoteArff(m.group(1)))
+        if "" == m.group(2):
+            return values
+        pos = m.end()
+
+
+# magic numbers, file name suffixes and openers of supported compression formats
+compressionFormats = [
+    (b"\x1f\x8b", ".gz", gzip.open),
+    (b"BZh", ".bz2", bz2.open),
+    (b"\xfd7zXZ\x00", ".xz", lzma.open),
+]
+
+
+def splitCompressionSuffix(fileName):
+    """
+    @param fileName: file name
+    @return: tuple of the file name without compression suffix and the opener of the compression format
+             (None for uncompressed files)
+    """
+    for _, suffix, opener in compressionFormats:
+        if fileName.lower().endswith(suffix):
+            return fileName[:-len(suffix)], opener
+    return fileName, None
+
+
+def openTextFile(fileName):
+    """
+    Open a text file for reading. gzip, bzip2 and xz compressed files are detected by their
+    magic number and decompressed transparently while reading.
+
+    @param fileName: file name
+    @return: tuple of file object and flag whether the file is compressed
+    """
+    with open(fileName, "rb") as f:
+        magic = f.read(6)
+
+    for signature, _, opener in compressionFormats:
+        if magic.startswith(signature):
+            return opener(fileName, "rt"), True
+    return open(fileName, "r"), False
+
+
+class ThreadedLineReader(object):
+    """
+    Line iterator which reads batches of lines from a file object in a background thread.
+    Used for compressed input so decompression (which releases the GIL) overlaps with parsing.
+    At most L{maxBatches} batches are buffered to keep memory bounded.
+    """
+
+    def __init__(self, f, batchSize=1 << 20, maxBatches=4):
+        self.f = f
+        self.batchSize = batchSize
+        self.__queue = queue.Queue(maxBatches)
+        self.__stop = Event()
+        self.__thread = Thread(target=self.__read, daemon=True)
+
+    def __read(self):
+        try:
+            while not self.__stop.is_set():
+                batch = self.f.readlines(self.batchSize)
+                self.__put(batch)
+                if not batch:
+                    break
+        except Exception as e:
+            self.__put(e)
+
+    def __put(self, item):
+        while not self.__stop.is_set():
+            try:
+                self.__queue.put(item, timeout=.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        self.__thread.start()
+        try:
+            while True:
+                batch = self.__queue.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                if not batch:
+                    break
+                yield from batch
+        finally:
+            self.close()
+
+    def close(self):
+        self.__stop.set()
+        if self.__thread.ident is not None:
+            self.__thread.join()
+
+
+def encodeLabels(chunks):
+    """
+    Encode chunks of class label strings as integer codes.
+
+    @param chunks: list of NumPy string arrays
+    @return: tuple of sorted list of distinct labels and NumPy array of codes
+    """
+    if not chunks:
+        return [], np.empty(0, dtype=np.intp)
+    names, codes = np.unique(np.concatenate(chunks), return_inverse=True)
+    return names.tolist(), codes.astype(np.intp).ravel()
+
+
+class ColumnSpool(object):
+    """
+    Collects the numeric columns of a relation chunk by chunk while it is parsed. Chunks are kept in RAM
+    until together they exceed the memory limit, then they are spilled to an anonymous temporary file
+    and so are all further chunks. Parsing a relation larger than RAM therefore needs no more memory than
+    the limit plus one chunk. The spooled columns are handed to L{RelationData.setData} with L{column}.
+    Every chunk is also added to a L{QuantileSketch}, so the data needs no further pass for estimating quantiles.
+    """
+
+    def __init__(self, numCols, dtype=np.float64, memoryLimit=None, directory=None):
+        """
+        @param numCols: number of numeric columns
+        @param dtype: float type of the stored values
+        @param memoryLimit: maximum number of bytes kept in RAM or None for no limit
+        @param directory: directory of the temporary file, the system default if None
+        """
+        self.numCols     = numCols
+        self.dtype       = np.dtype(dtype)
+        self.memoryLimit = memoryLimit
+        self.directory   = directory
+        self.numRows     = 0
+        self.sketch      = QuantileSketch(numCols)
+        self.__chunks    = [[] for _ in range(numCols)]
+        self.__file      = None
+        # number of rows of each spilled chunk
+        self.__sizes     = []
+
+    @property
+    def isSpilled(self):
+        return self.__file is not None
+
+    def append(self, columns):
+        """
+        Add a chunk of rows.
+
+        @param columns: one array per column, all of the same length
+        """
+        if not self.numCols:
+            return
+        columns = [np.asarray(c, dtype=self.dtype) for c in columns]
+        self.numRows += len(columns[0])
+        self.sketch.updateColumns(columns)
+        if self.__file is None:
+            for chunks, c in zip(self.__chunks, columns):
+                chunks.append(c)
+            if self.memoryLimit is not None and self.numRows * self.numCols * self.dtype.itemsize > self.memoryLimit:
+                self.__file = tempfile.TemporaryFile(dir=self.directory, prefix="spool-")
+                for k in range(len(self.__chunks[0])):
+                    self.__spill([chunks[k] for chunks in self.__chunks])
+                self.__chunks = [[] for _ in range(self.numCols)]
+        else:
+            self.__spill(columns)
+
+    def __spill(self, columns):
+        # chunks are stored one after another, each of them column by column
+        for c in columns:
+            self.__file.write(np.ascontiguousarray(c))
+        self.__sizes.append(len(columns[0]))
+
+    def __readColumn(self, index):
+        start = 0
+        for n in self.__sizes:
+            self.__file.seek((start * self.numCols + index * n) * self.dtype.itemsize)
+            yield np.frombuffer(self.__file.read(n * self.dtype.itemsize), dtype=self.dtype)
+            start += n
+
+    def column(self, index):
+        """
+        @param index: column index
+        @return: list of the chunks of a column kept in RAM, which L{RelationData.setData} empties while
+                 copying, or an iterator reading the chunks from the temporary file one by one
+        """
+        if self.__file is None:
+            return self.__chunks[index]
+        return self.__readColumn(index)
+
+    def quantiles(self, qs, positions, numCols):
+        """
+        Estimated quantiles of the spooled columns laid out for a relation with further (nominal) columns.
+
+        @param qs: quantiles in [0, 1]
+        @param positions: column index in the relation of each spooled column
+        @param numCols: number of columns of the relation
+        @return: array of shape (len(qs), numCols), NaN for columns which are not spooled
+        """
+        result = np.full((len(qs), numCols), np.nan)
+        result[:, positions] = self.sketch.quantiles(qs)
+        return result
+
+    def close(self):
+        """
+        Release all chunks and remove the temporary file.
+        """
+        self.__chunks = [[] for _ in range(self.numCols)]
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+class RelationReader(object):
+    """
+    Base class for input format readers registered with L{RelationFactory}.
+    """
+
+    # format name shown in error messages
+    name = ""
+    # lower case file name extensions handled by this reader
+    extensions = ()
+    # number of data lines which are converted to column arrays at once
+    chunkSize = 65536
+
+    def sniff(self, sample):
+        """
+        Check whether a text sample looks like the beginning of a file in this format.
+        Used for files whose extension is not registered.
+
+        @param sample: first few kilobytes of the file
+        @return: True if this reader can read the file
+        """
+        return False
+
+    @abstractmethod
+    def read(self, lines, rel, **options):
+        """
+        Parse input into a relation.
+
+        @param lines: iterable of lines
+        @param rel: empty L{RelationData} instance to fill
+        @param options: format-specific options
+        @return: rel
+        """
+        pass
+
+
+class ArffReader(RelationReader):
+    name = "ARFF"
+    extensions = (".arff",)
+
+    def sniff(self, sample):
+        for l in sample.splitlines():
+            l = l.strip()
+            if "" == l or "%" == l[0]:
+                continue
+            return l.upper().startswith("@RELATION")
+        return False
+
+    @staticmethod
+    def parseAttribute(line):
+        """
+        Parse an @ATTRIBUTE declaration.
+
+        @param line: declaration line
+        @return: tuple of attribute name, type ("numeric", "nominal" or "string") and list of nominal values
+        """
+        m = re.match(r"@ATTRIBUTE\s+('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\S+)\s+(.+)$", line, re.IGNORECASE)
+        name = unquoteArff(m.group(1))
+        typeDecl = m.group(2).strip()
+        if "{" == typeDecl[0]:
+            values = [v.strip() for v in splitArffValues(typeDecl[1:typeDecl.rindex("}")])]
+            return name, "nominal", values
+
+        if typeDecl.split()[0].upper() in ("NUMERIC", "REAL", "INTEGER"):
+            return name, "numeric", None
+        return name, "string", None
+
+    def read(self, lines, rel, **options):
+        """
+        Parse ARFF data into a relation.
+        The last non-numeric attribute is used as class attribute (the last attribute if all attributes are numeric).
+        NUMERIC attributes are stored as float columns, all other nominal attributes as columns of integer codes
+        referring to their list of declared values. STRING and DATE attributes are skipped. Data lines are
+        converted in chunks of L{chunkSize} lines so no Python objects are kept per cell.
+
+        @param lines: iterable of lines
+        @param rel: empty L{RelationData} instance to fill
+        @param options: unused
+        @return: rel
+        """
+        relName = ""
+        relDeclaration = "@RELATION relation"
+        attributes = []
+        declarations = []
+        lines = iter(lines)
+        for l in lines:
+            l = l.strip()
+            if "" == l or "%" == l[0]:
+                continue
+
+            fields = re.split(r"\s+", l)
+            keyword = fields[0].upper()
+            if "@RELATION" == keyword:
+                relName = fields[1]
+                relDeclaration = l
+            elif "@ATTRIBUTE" == keyword:
+                attributes.append(self.parseAttribute(l))
+                declarations.append(l)
+            elif "@DATA" == keyword:
+                break
+            else:
+                raise ValueError("Unexpected header line: " + l)
+
+        nonNumeric = [i for i, a in enumerate(attributes) if "numeric" != a[1]]
+        classCol = nonNumeric[-1] if nonNumeric else len(attributes) - 1
+        axisCols = [i for i, a in enumerate(attributes) if i != classCol and "string" != a[1]]
+
+        # lookup tables for nominal codes, quoted spellings map to the same code
+        lookups = {}
+        for i, a in enumerate(attributes):
+            if "nominal" == a[1]:
+                lookups[i] = {}
+                for code, v in enumerate(a[2]):
+                    lookups[i][v] = lookups[i]["'" + v + "'"] = lookups[i]['"' + v + '"'] = code
+                # missing class labels form a class of their own
+                lookups[i]["?"] = len(a[2]) if i == classCol else missingCode(codeType(len(a[2])))
+
+        # numeric columns are spooled, so they can be spilled to disk while parsing large files
+        numericCols = [i for i in axisCols if i not in lookups]
+        spool = ColumnSpool(len(numericCols), rel.storageType, rel.memoryLimit, rel.mappedDirectory)
+        chunks = {i: [] for i in axisCols + [classCol] if i in lookups or i == classCol}
+        numCols = len(attributes)
+
+        def convertChunk(rows):
+            cols = list(zip(*rows))
+            for i in chunks:
+                if i in lookups:
+                    dtype = codeType(len(attributes[i][2])) if i != classCol else np.intp
+                    chunks[i].append(np.fromiter(map(lookups[i].__getitem__, map(str.strip, cols[i])),
+                                                 dtype=dtype, count=len(rows)))
+                else:
+                    chunks[i].append(np.array([v.strip().strip("'\"") for v in cols[i]]))
+            spool.append([parseFloats(cols[i], rel.storageType) for i in numericCols])
+
+        try:
+            rows = []
+            for l in lines:
+                l = l.strip()
+                if "" == l or "%" == l[0]:
+                    continue
+
+                fields = splitArffValues(l)
+                if len(fields) != numCols:
+                    raise ValueError("Invalid number of fields: " + l)
+                rows.append(fields)
+                if len(rows) >= self.chunkSize:
+                    convertChunk(rows)
+                    rows = []
+            if rows:
+                convertChunk(rows)
+
+            # numeric columns are handed over as spooled chunks, which setData() copies into its storage one by one
+            columns = []
+            nominalValues = {}
+            for j, i in enumerate(axisCols):
+                if i in lookups:
+                    nominalValues[j] = attributes[i][2]
+                    dtype = codeType(len(attributes[i][2]))
+                    columns.append(np.concatenate(chunks[i]) if chunks[i] else np.empty(0, dtype=dtype))
+                else:
+                    columns.append(spool.column(numericCols.index(i)))
+
+            if classCol in lookups:
+                classNames = list(attributes[classCol][2])
+                classCodes = np.concatenate(chunks[classCol]) if chunks[classCol] else np.empty(0, dtype=np.intp)
+                if (classCodes == len(classNames)).any():
+                    classNames.append("?")
+            else:
+                classNames, classCodes = encodeLabels(chunks[classCol])
+
+            rel.relName = relName
+            quantiles = spool.quantiles(rel.sketchQuantiles, [axisCols.index(i) for i in numericCols], len(axisCols))
+            rel.setData([attributes[i][0] for i in axisCols + [classCol]], columns, classCodes, classNames,
+                        nominalValues, quantiles)
+            fieldCols = axisCols + [classCol]
+            rel.sourceHeader = {
+                "format":     self.name,
+                "relation":   relDeclaration,
+                "attributes": [[d, a[0], fieldCols.index(i) if i in fieldCols else None]
+                               for i, (d, a) in enumerate(zip(declarations, attributes))],
+            }
+        finally:
+            spool.close()
+        return rel
+
+
+class CsvReader(RelationReader):
+    """
+    Reader for delimiter-separated text files with an optional header line.
+    Column types are inferred from a sample of L{sampleSize} lines: columns whose sampled values are all
+    numbers are parsed in bulk into float columns, all other columns are dictionary-encoded as nominal attributes.
+    """
+
+    name = "CSV"
+    extensions = (".csv", ".tsv", ".tab")
+    delimiters = ",\t;"
+    sampleSize = 1000
+
+    @staticmethod
+    def isNumber(value):
+        try:
+            float(value)
+            return True
+        except ValueError:
+            return False
+
+    @staticmethod
+    def detectDelimiter(lines):
+        """
+        @param lines: sample lines
+        @return: first candidate delimiter which occurs equally often (and at least once) in all lines or None
+        """
+        for d in CsvReader.delimiters:
+            counts = set(l.count(d) for l in lines)
+            if len(counts) == 1 and counts.pop() > 0:
+                return d
+        return None
+
+    def sniff(self, sample):
+        # the last line of the sample may be cut off
+        lines = [l for l in sample.splitlines()[:-1] if l.strip()][:20]
+        return len(lines) > 1 and self.detectDelimiter(lines) is not None
+
+    def read(self, lines, rel, delimiter=None, classColumn=-1, header=None, **options):
+        """
+        Parse delimiter-separated data into a relation.
+
+        @param lines: iterable of lines
+        @param rel: empty L{RelationData} instance to fill
+        @param delimiter: field delimiter, detected from the sample if None
+        @param classColumn: name or index of the class column (default: last column)
+        @param header: whether the first line contains column names, detected from the sample if None
+        @param options: unused
+        @return: rel
+        """
+        lines = iter(lines)
+        sample = [l for l in itertools.islice(lines, self.sampleSize) if l.strip()]
+        if delimiter is None:
+            delimiter = self.detectDelimiter(sample[:20]) or ","
+
+        sampleRows = list(csv.reader(sample, delimiter=delimiter))
+        if header is None:
+            header = not any(self.isNumber(c) for c in sampleRows[0])
+        if header:
+            fieldNames = [c.strip() for c in sampleRows[0]]
+            sampleRows = sampleRows[1:]
+        else:
+            fieldNames = ["attr" + str(i + 1) for i in range(len(sampleRows[0]))]
+
+        numCols = len(fieldNames)
+        classCol = fieldNames.index(classColumn) if isinstance(classColumn, str) else range(numCols)[classColumn]
+        # columns are numeric if all sampled values are numbers or missing
+        numeric = [all(r[i].strip() in missingValues or self.isNumber(r[i]) for r in sampleRows) and
+                   any(self.isNumber(r[i]) for r in sampleRows) for i in range(numCols)]
+        axisCols = [i for i in range(numCols) if i != classCol]
+
+        # missing nominal values are marked by the largest code, which is converted to the final code type later
+        lookups = {i: {v: missingCode(np.uint32) for v in missingValues} for i in axisCols if not numeric[i]}
+        numericCols = [i for i in axisCols if numeric[i]]
+        spool = ColumnSpool(len(numericCols), rel.storageType, rel.memoryLimit, rel.mappedDirectory)
+        chunks = {i: [] for i in list(lookups) + [classCol]}
+
+        def convertChunk(rows):
+            cols = list(zip(*rows))
+            for i in lookups:
+                lookup = lookups[i]
+                chunks[i].append(np.fromiter((lookup.setdefault(v.strip(), len(lookup) - len(missingValues)) for v in cols[i]),
+                                             dtype=np.uint32, count=len(rows)))
+            spool.append([parseFloats(cols[i], rel.storageType) for i in numericCols])
+            chunks[classCol].append(np.array([v.strip() for v in cols[classCol]]))
+
+        try:
+            rows = []
+            for r in itertools.chain(sampleRows, csv.reader(lines, delimiter=delimiter)):
+                if not r:
+                    continue
+                if len(r) != numCols:
+                    raise ValueError("Invalid number of fields: " + delimiter.join(r))
+                rows.append(r)
+                if len(rows) >= self.chunkSize:
+                    convertChunk(rows)
+                    rows = []
+            if rows:
+                convertChunk(rows)
+
+            columns = []
+            nominalValues = {}
+            for j, i in enumerate(axisCols):
+                if i in lookups:
+                    values = [v for v in lookups[i] if v not in missingValues]
+                    dtype = codeType(len(values))
+                    nominalValues[j] = values
+                    codes = np.concatenate(chunks[i]) if chunks[i] else np.empty(0, dtype=np.uint32)
+                    missing = codes == missingCode(np.uint32)
+                    codes = codes.astype(dtype)
+                    codes[missing] = missingCode(dtype)
+                    columns.append(codes)
+                else:
+                    columns.append(spool.column(numericCols.index(i)))
+
+            classNames, classCodes = encodeLabels(chunks[classCol])
+            quantiles = spool.quantiles(rel.sketchQuantiles, [axisCols.index(i) for i in numericCols], len(axisCols))
+            rel.setData([fieldNames[i] for i in axisCols + [classCol]], columns, classCodes, classNames,
+                        nominalValues, quantiles)
+            fieldCols = axisCols + [classCol]
+            rel.sourceHeader = {
+                "format":     self.name,
+                "relation":   None,
+                "attributes": [[n, n, fieldCols.index(i)] for i, n in enumerate(fieldNames)],
+            }
+        finally:
+            spool.close()
+        return rel
+
+
+def joinColumns(fields, delimiter):
+    """
+    Join formatted columns into delimiter-separated lines without creating a Python object per line.
+    The fields are copied side by side into one byte matrix, from which all unused bytes are removed
+    with a single boolean mask.
+
+    @param fields: list of byte fields of equal length as returned by L{byteField} or L{formatFloats}
+    @param delimiter: single-byte field delimiter
+    @return: NumPy uint8 array with the encoded lines, each terminated by a newline
+    """
+    numRows = len(fields[0][0])
+    widths = [c.shape[1] for c, _ in fields]
+    buf = np.empty((numRows, sum(widths) + len(fields)), dtype=np.uint8)
+    valid = np.empty(buf.shape, dtype=bool)
+    offset = 0
+    for i, (chars, used) in enumerate(fields):
+        w = widths[i]
+        buf[:, offset:offset + w] = chars
+        valid[:, offset:offset + w] = used
+        offset += w
+        buf[:, offset] = ord("\n") if i == len(fields) - 1 else ord(delimiter)
+        valid[:, offset] = True
+        offset += 1
+    return buf[valid]
+
+
+class RelationWriter(object):
+    """
+    Base class for output format writers registered with L{RelationFactory}.
+    Datasets are written in chunks of L{chunkSize}: each column of a chunk is formatted by vectorized
+    conversions, the columns are joined by L{joinColumns} and written as one buffer.
+    Attributes are written in the order of the source file (see L{RelationData.sourceHeader}).
+    """
+
+    # format name shown in file dialogs
+    name = ""
+    # lower case file name extensions handled by this writer, the first one is the default
+    extensions = ()
+    # number of datasets which are formatted at once
+    chunkSize = 65536
+    # spelling of missing values
+    missingValue = missingValues[0]
+    # field delimiter by file name extension, "" for all other extensions
+    delimiters = {"": ","}
+
+    def delimiter(self, fileName):
+        """
+        @param fileName: file name without compression suffix
+        @return: default field delimiter for the file
+        """
+        ext = os.path.splitext(fileName)[1].lower()
+        return self.delimiters.get(ext, self.delimiters[""])
+
+    def quote(self, value, delimiter):
+        """
+        Quote a name or nominal value if necessary.
+
+        @param value: string
+        @param delimiter: field delimiter
+        @return: quoted string
+        """
+        return value
+
+    @staticmethod
+    def sourceAttributes(rel):
+        """
+        Attributes of the source file of a relation in their original order. Warns if the relation no
+        longer matches its source file or if attributes of the source file were not loaded.
+
+        @param rel: L{RelationData} instance
+        @return: list of declaration, attribute name and field index (None for attributes which were not
+                 loaded), or None if the source file is unknown or does not match
+        """
+        if rel.sourceHeader is None:
+            return None
+        attributes = rel.sourceHeader["attributes"]
+        indices = sorted(i for _, _, i in attributes if i is not None)
+        if indices != list(range(len(rel.fieldNames))) or \
+                any(rel.fieldNames[i] != name for _, name, i in attributes if i is not None):
+            warnings.warn("Attributes differ from the source file, the original header is not written")
+            return None
+        if any(i is None for _, _, i in attributes):
+            warnings.warn("Attributes of the source file which were not loaded are written as missing values")
+        return attributes
+
+    @abstractmethod
+    def header(self, rel, delimiter, attributes):
+        """
+        @param rel: L{RelationData} instance
+        @param delimiter: field delimiter
+        @param attributes: attributes of the source file returned by L{sourceAttributes} or None
+        @return: header text including the trailing newline
+        """
+        pass
+
+    def valueTable(self, values, delimiter):
+        """
+        @return: byte string array with the quoted values and the missing value marker as last element
+        """
+        return np.array([self.quote(v, delimiter).encode("utf-8") for v in values] +
+                        [self.missingValue.encode("utf-8")])
+
+    def write(self, f, rel, rows=None, delimiter=",", **options):
+        """
+        Write the original (unscaled) values of datasets of a relation.
+
+        @param f: binary file object
+        @param rel: L{RelationData} instance
+        @param rows: indices into L{RelationData.dataMatrix} of the datasets to write or None for all datasets
+        @param delimiter: field delimiter
+        @param options: format-specific options
+        """
+        attributes = self.sourceAttributes(rel)
+        f.write(self.header(rel, delimiter, attributes).encode("utf-8"))
+        order = [i for _, _, i in attributes] if attributes else list(range(len(rel.fieldNames)))
+        classIndex = len(rel.fieldNames) - 1
+
+        matrix = rel.dataMatrix()
+        classNames, codes = rel.classCodes()
+        tables = {i: self.valueTable(v, delimiter) for i, v in rel.nominalValues.items()}
+        classTable = self.valueTable(classNames, delimiter)
+        missing = self.missingValue.encode("utf-8")
+        numRows = len(codes) if rows is None else len(rows)
+
+        for start in range(0, numRows, self.chunkSize):
+            if rows is None:
+                chunk = slice(start, min(start + self.chunkSize, numRows))
+            else:
+                chunk = np.asarray(rows[start:start + self.chunkSize], dtype=np.intp)
+
+            chunkCodes = codes[chunk]
+            fields = []
+            for i in order:
+                if i is None:
+                    fields.append(byteField(np.full(len(chunkCodes), missing)))
+                elif i == classIndex:
+                    fields.append(byteField(classTable[chunkCodes]))
+                elif i in tables:
+                    values = matrix[chunk, i]
+                    table = tables[i]
+                    fields.append(byteField(table[np.where(np.isnan(values), len(table) - 1, values).astype(np.intp)]))
+                else:
+                    fields.append(formatFloats(matrix[chunk, i], missing))
+            f.write(joinColumns(fields, delimiter))
+
+
+class ArffWriter(RelationWriter):
+    name = "ARFF"
+    extensions = (".arff",)
+
+    def quote(self, value, delimiter):
+        if value == self.missingValue or value and not re.search(r"[\s,'\"{}%\\]", value):
+            return value
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+    def header(self, rel, delimiter, attributes):
+        """
+        The declarations of ARFF source files are written unchanged. Otherwise the header is built from
+        the relation name and the attribute values, missing class labels are not declared.
+        """
+        if attributes is not None and rel.sourceHeader["format"] == self.name:
+            lines = [rel.sourceHeader["relation"], ""] + [d for d, _, _ in attributes]
+        else:
+            lines = ["@RELATION " + (rel.relName or "relation"), ""]
+            classIndex = len(rel.fieldNames) - 1
+            for i in ([i for _, _, i in attributes] if attributes else range(len(rel.fieldNames))):
+                if i == classIndex:
+                    values = [c for c in rel.classCodes()[0] if c != self.missingValue]
+                elif i in rel.nominalValues:
+                    values = rel.nominalValues[i]
+                else:
+                    values = None
+                typeDecl = "NUMERIC" if values is None else "{" + ",".join(self.quote(v, delimiter) for v in values) + "}"
+                lines.append("@ATTRIBUTE {} {}".format(self.quote(rel.fieldNames[i], delimiter), typeDecl))
+        lines += ["", "@DATA", ""]
+        return "\n".join(lines)
+
+    def write(self, f, rel, rows=None, delimiter=",", **options):
+        super().write(f, rel, rows, ",")
+
+
+class CsvWriter(RelationWriter):
+    name = "CSV"
+    extensions = (".csv", ".tsv", ".tab")
+    delimiters = {"": ",", ".tsv": "\t", ".tab": "\t"}
+
+    def quote(self, value, delimiter):
+        if delimiter in value or '"' in value or "\n" in value:
+            return '"' + value.replace('"', '""') + '"'
+        return value
+
+    def header(self, rel, delimiter, attributes):
+        names = [n for _, n, _ in attributes] if attributes else rel.fieldNames
+        return delimiter.join(self.quote(n, delimiter) for n in names) + "\n"
+
+
+class ClassStatistics(object):
+    """
+    Summary statistics of all datasets belonging to one class.
+    All value attributes are NumPy arrays with one entry per (non-class) attribute.
+    """
+
+    def __init__(self, cls, count, minVals, maxVals, mean, std, quantiles):
+        self.cls       = cls
+        self.count     = count
+        self.minVals   = minVals
+        self.maxVals   = maxVals
+        self.mean      = mean
+        self.std       = std
+        self.quantiles = quantiles
+
+    def quantile(self, q):
+        """
+        @param q: quantile in [0, 1], must be one of the quantiles the statistics have been computed for
+        @return: array of per-attribute quantile values
+        """
+        return self.quantiles[q]
+
+
+class DatasetCluster(object):
+    """
+    Group of similar datasets of one class, represented by the cluster center in scaled coordinates.
+    """
+
+    def __init__(self, cls, center, members):
+        self.cls     = cls
+        self.center  = center
+        self.members = members
+
+    @property
+    def size(self):
+        return len(self.members)
+
+
+def nearestCenters(points, centers, chunkSize=65536):
+    """
+    Assign each point to its closest center (squared Euclidean distance).
+    Points are processed in chunks to keep the distance matrix small.
+
+    @param points: 2D NumPy array of points
+    @param centers: 2D NumPy array of cluster centers
+    @param chunkSize: number of points per chunk
+    @return: NumPy array with the index of the closest center for each point
+    """
+    labels = np.empty(len(points), dtype=np.intp)
+    centerNorms = (centers ** 2).sum(axis=1)
+    for start in range(0, len(points), chunkSize):
+        chunk = points[start:start + chunkSize]
+        dists = centerNorms - 2 * chunk.dot(centers.T)
+        labels[start:start + chunkSize] = np.argmin(dists, axis=1)
+    return labels
+
+
+def miniBatchKMeans(points, numClusters, batchSize=1024, numIterations=100, seed=0, cancelled=None):
+    """
+    Cluster points using mini-batch k-means. Each iteration moves the centers towards the mean
+    of a small random sample, so the cost per iteration does not depend on the number of points.
+
+    @param points: 2D NumPy array of points
+    @param numClusters: maximum number of clusters
+    @param batchSize: number of points sampled per iteration
+    @param numIterations: number of mini-batch iterations
+    @param seed: random seed for reproducible clusterings
+    @param cancelled: optional L{threading.Event}, the remaining iterations are skipped once it is set
+    @return: tuple of cluster centers and the cluster label of each point
+    """
+    numPoints = len(points)
+    if numPoints <= numClusters:
+        return points.copy(), np.arange(numPoints)
+
+    rng = np.random.RandomState(seed)
+    centers = points[rng.choice(numPoints, numClusters, replace=False)].copy()
+    counts = np.zeros(numClusters)
+
+    for _ in range(numIterations):
+        if cancelled is not None and cancelled.is_set():
+            break
+        batch = points[rng.randint(0, numPoints, min(batchSize, numPoints))]
+        labels = nearestCenters(batch, centers)
+        batchCounts = np.bincount(labels, minlength=numClusters)
+        batchSums = np.zeros_like(centers)
+        np.add.at(batchSums, labels, batch)
+
+        # running mean per center with learning rate 1 / (number of points seen so far)
+        counts += batchCounts
+        updated = batchCounts > 0
+        centers[updated] += (batchSums[updated] - batchCounts[updated, np.newaxis] * centers[updated]) \
+            / counts[updated, np.newaxis]
+
+    labels = nearestCenters(points, centers)
+    used = np.unique(labels)
+    remap = np.zeros(numClusters, dtype=np.intp)
+    remap[used] = np.arange(len(used))
+    return centers[used], remap[labels]
+
+
+class PointGridIndex(object):
+    """
+    Uniform grid over 2D points for nearest-neighbour lookups. Points are sorted by grid cell, so the
+    points of a column of cells form one contiguous range, which is found by binary search.
+    """
+
+    def __init__(self, points, cellSize=None, pointsPerCell=2):
+        """
+        @param points: array-like of shape (n, 2)
+        @param cellSize: edge length of a grid cell, best set to the typical search radius
+        @param pointsPerCell: average number of points per cell used to choose the cell size if none is given
+        """
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        numPoints = len(self.points)
+        if numPoints == 0:
+            self.__origin = np.zeros(2)
+            self.cellSize = 1.
+            self.__shape = (0, 0)
+            self.__order = np.empty(0, dtype=np.intp)
+            self.__keys = np.empty(0, dtype=np.intp)
+            return
+
+        self.__origin = self.points.min(axis=0)
+        extent = self.points.max(axis=0) - self.__origin
+        if cellSize is None:
+            area = max(extent[0], 1e-9) * max(extent[1], 1e-9)
+            cellSize = math.sqrt(area * pointsPerCell / numPoints)
+        self.cellSize = max(cellSize, 1e-9)
+
+        cells = np.floor((self.points - self.__origin) / self.cellSize).astype(np.intp)
+        self.__shape = tuple(cells.max(axis=0) + 1)
+        keys = cells[:, 0] * self.__shape[1] + cells[:, 1]
+        self.__order = np.argsort(keys, kind="stable")
+        self.__keys = keys[self.__order]
+        self.__sortedX = np.ascontiguousarray(self.points[self.__order, 0])
+        self.__sortedY = np.ascontiguousarray(self.points[self.__order, 1])
+
+    def __len__(self):
+        return len(self.points)
+
+    def __candidates(self, cx, cy, r):
+        """
+        @return: positions in the cell-sorted order of all points in the square of cells around (cx, cy)
+        """
+        xs = np.arange(max(cx - r, 0), min(cx + r, self.__shape[0] - 1) + 1)
+        y0 = max(cy - r, 0)
+        y1 = min(cy + r, self.__shape[1] - 1)
+        if len(xs) == 0 or y0 > y1:
+            return np.empty(0, dtype=np.intp)
+        lo = np.searchsorted(self.__keys, xs * self.__shape[1] + y0, "left")
+        hi = np.searchsorted(self.__keys, xs * self.__shape[1] + y1, "right")
+        lengths = hi - lo
+        # concatenate the ranges lo[i]:hi[i] without a Python loop
+        starts = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+        return np.arange(lengths.sum()) + starts
+
+    def __closest(self, candidates, x, y):
+        d = np.hypot(self.__sortedX[candidates] - x, self.__sortedY[candidates] - y)
+        i = int(np.argmin(d))
+        return int(self.__order[candidates[i]]), float(d[i])
+
+    def nearest(self, x, y, maxDistance=None):
+        """
+        Find the point closest to (x, y).
+
+        @param maxDistance: ignore points further away than this
+        @return: tuple of point index and distance or (-1, inf) if there is no such point
+        """
+        if len(self.points) == 0:
+            return -1, math.inf
+
+        cx, cy = (int(v) for v in np.floor((np.array((x, y)) - self.__origin) / self.cellSize))
+        if maxDistance is not None:
+            r = int(math.ceil(maxDistance / self.cellSize))
+            candidates = self.__candidates(cx, cy, r)
+            if len(candidates) == 0:
+                return -1, math.inf
+            index, dist = self.__closest(candidates, x, y)
+            return (index, dist) if dist <= maxDistance else (-1, math.inf)
+
+        # grow the searched square until it contains a point, then make sure it covers the found distance
+        r = 1
+        maxR = max(self.__shape) + max(abs(cx), abs(cy))
+        while True:
+            candidates = self.__candidates(cx, cy, r)
+            if len(candidates):
+                index, dist = self.__closest(candidates, x, y)
+                needed = int(math.ceil(dist / self.cellSize))
+                if needed > r:
+                    index, dist = self.__closest(self.__candidates(cx, cy, needed), x, y)
+                return index, dist
+            if r > maxR:
+                return -1, math.inf
+            r *= 2
+
+
+class QuantileSketch(object):
+    """
+    Mergeable streaming quantile sketch for all columns of a matrix at once (a simple KLL-style
+    compactor hierarchy). Level h holds values with weight 2**h. Whenever a level exceeds the
+    capacity, it is sorted and every other value is promoted to the next level. Since all columns
+    receive the same number of values, one level structure is shared by all of them and every
+    compaction is a single vectorized sort. The rank error is about log2(n / capacity) / capacity.
+    NaN values are ignored by L{quantiles}.
+    """
+
+    def __init__(self, numCols, capacity=1024):
+        self.numCols  = numCols
+        self.capacity = capacity
+        self.count    = 0
+        # one (numCols, n) array per level, so values of one column are contiguous for sorting
+        self.levels   = []
+        self.__offsets = []
+
+    def __add(self, level, values):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty((self.numCols, 0)))
+            self.__offsets.append(0)
+        if self.levels[level].shape[1]:
+            self.levels[level] = np.concatenate((self.levels[level], values), axis=1)
+        else:
+            self.levels[level] = values
+
+    def __compact(self):
+        h = 0
+        while h < len(self.levels):
+            buf = self.levels[h]
+            if buf.shape[1] > self.capacity:
+                buf = np.sort(buf, axis=1)
+                # keep the largest value of an odd number of values, alternate which half is promoted
+                keep = buf.shape[1] % 2
+                offset = self.__offsets[h]
+                self.__offsets[h] ^= 1
+                # copy the kept values, views would keep the whole sorted buffer alive
+                self.levels[h] = buf[:, buf.shape[1] - keep:].copy()
+                self.__add(h + 1, np.ascontiguousarray(buf[:, offset:buf.shape[1] - keep:2]))
+            h += 1
+
+    def update(self, values):
+        """
+        Add rows of values.
+
+        @param values: array of shape (n, numCols)
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1, self.numCols)
+        self.updateColumns(values.T)
+
+    def updateColumns(self, columns):
+        """
+        Add values given column by column.
+
+        @param columns: sequence of numCols arrays of equal length
+        """
+        columns = np.array(columns, dtype=np.float64, order="C").reshape(self.numCols, -1)
+        if columns.shape[1]:
+            self.count += columns.shape[1]
+            self.__add(0, columns)
+            self.__compact()
+
+    def merge(self, other):
+        """
+        Add all values summarized by another sketch of the same number of columns.
+        """
+        for h, buf in enumerate(other.levels):
+            if buf.shape[1]:
+                self.__add(h, buf.copy())
+        self.count += other.count
+        self.__compact()
+
+    def quantiles(self, qs):
+        """
+        @param qs: quantiles in [0, 1]
+        @return: array of shape (len(qs), numCols), NaN for columns without values
+        """
+        result = np.full((len(qs), self.numCols), np.nan)
+        levels = [b for b in self.levels if b.shape[1]]
+        if not levels:
+            return result
+
+        values = np.concatenate(levels, axis=1)
+        weights = np.concatenate([np.full(b.shape[1], 2. ** h) for h, b in enumerate(self.levels) if b.shape[1]])
+        order = np.argsort(values, axis=1, kind="stable")
+        values = np.take_along_axis(values, order, axis=1)
+        cumWeights = np.cumsum(np.where(np.isnan(values), 0., weights[order]), axis=1)
+        total = cumWeights[:, -1]
+        rows = np.arange(self.numCols)
+        for i, q in enumerate(qs):
+            rank = (cumWeights < q * total[:, np.newaxis]).sum(axis=1)
+            result[i] = np.where(total > 0, values[rows, np.minimum(rank, values.shape[1] - 1)], np.nan)
+        return result
+
+
+def sketchMatrix(matrix, numWorkers, chunkRows=65536, capacity=1024):
+    """
+    Build a L{QuantileSketch} over the rows of a matrix. Row chunks are sketched in parallel
+    and the partial sketches merged afterwards.
+
+    @return: L{QuantileSketch}
+    """
+    def sketchChunk(start):
+        sketch = QuantileSketch(matrix.shape[1], capacity)
+        sketch.update(matrix[start:start + chunkRows])
+        return sketch
+
+    starts = range(0, len(matrix), chunkRows)
+    if numWorkers <= 1 or len(starts) <= 1:
+        sketches = [sketchChunk(s) for s in starts]
+    else:
+        with ThreadPoolExecutor(min(numWorkers, len(starts))) as executor:
+            sketches = list(executor.map(sketchChunk, starts))
+
+    sketch = QuantileSketch(matrix.shape[1], capacity)
+    for s in sketches:
+        sketch.merge(s)
+    return sketch
+
+
+def columnBlocks(numCols, numWorkers, minBlockSize=64, maxBlockSize=None):
+    """
+    Split a range of columns into contiguous blocks for parallel processing.
+
+    @param numCols: number of columns
+    @param numWorkers: maximum number of blocks, unless more are needed to satisfy maxBlockSize
+    @param minBlockSize: minimum number of columns per block
+    @param maxBlockSize: maximum number of columns per block (None for no limit)
+    @return: list of slices
+    """
+    numBlocks = max(1, min(numWorkers, numCols // max(1, minBlockSize)))
+    if maxBlockSize is not None:
+        numBlocks = max(numBlocks, -(-numCols // max(1, maxBlockSize)))
+    bounds = np.linspace(0, numCols, numBlocks + 1).astype(int)
+    return [slice(bounds[i], bounds[i + 1]) for i in range(numBlocks)]
+
+
+def mapColumnBlocks(func, numCols, numWorkers, minBlockSize=64, maxBlockSize=None):
+    """
+    Call a function for blocks of columns, using a thread pool if there is more than one block.
+    The function should spend its time in NumPy kernels which release the GIL.
+
+    @param func: function taking a column slice
+    @param numCols: number of columns
+    @param numWorkers: maximum number of worker threads
+    @param minBlockSize: minimum number of columns per block
+    @param maxBlockSize: maximum number of columns per block (None for no limit)
+    @return: list of results in column order
+    """
+    blocks = columnBlocks(numCols, numWorkers, minBlockSize, maxBlockSize)
+    if len(blocks) == 1 or numWorkers <= 1:
+        return [func(b) for b in blocks]
+
+    with ThreadPoolExecutor(min(numWorkers, len(blocks))) as executor:
+        return list(executor.map(func, blocks))
+
+
+class RelationData(object):
+    """
+    Relation storage without Qt dependency. Instances can be pickled and sent to worker processes
+    or shared via L{toSharedMemory}. Derived data (scaled matrices, statistics, clusters) is not pickled.
+    """
+
+    ScaleModeGlobal = 0
+    ScaleModeLocal  = 2
+    # per-axis 1st to 99th percentile, values outside are clipped to the axis ends
+    ScaleModePercentile = 3
+    # per-axis (value - median) / IQR with the median at the axis center and robustScaleWidth inter-quartile
+    # ranges to either side, values outside are clipped
+    ScaleModeRobust     = 4
+    robustScaleWidth    = 2
+
+    # quantiles kept from the sketch built when data is set, in the order used by the robust scale modes
+    sketchQuantiles = (.01, .25, .5, .75, .99)
+
+    # float type of the data matrix. np.float32 halves memory and disk usage, but only keeps about 7
+    # significant decimal digits (integers are exact up to 2**24), which is far more than a pixel
+    # on screen, but may round e.g. timestamps or large IDs. Statistics are accumulated in float64.
+    storageType = np.float64
+    # matrices larger than this number of bytes are stored in memory-mapped temporary files
+    # in mappedDirectory (None for the system default) instead of RAM, None to never map
+    memoryLimit = None
+    mappedDirectory = None
+    # maximum size in bytes of the column blocks read at once from memory-mapped matrices
+    blockBytes = 64 * 1024 * 1024
+
+    def __init__(self):
+        super().__init__()
+
+        self.relName            = ""
+        self.__fieldNames       = []
+        self.__fieldNamesAll    = []
+        self.__columns          = []
+        self.__classCodesAll    = np.empty(0, dtype=np.intp)
+        self.__classNames       = []
+        self.__matrixAll        = np.empty((0, 0))
+        self.__rowIndices       = None
+        self.__datasets         = None
+        self.__datasetsPerClass = {}
+        self.nominalValues      = {}
+        self.allClasses         = set()
+        self.activeClasses      = set()
+        self.numDatasets        = 0
+        # attribute declarations of the source file set by readers for writing the original header again:
+        # dict with the "format" name, the "relation" declaration and a list of "attributes", each of them
+        # a list of declaration, attribute name and index into fieldNames (None for attributes not loaded)
+        self.sourceHeader       = None
+
+        self.__scaled_datasets = None
+        self.__scale_mode       = self.ScaleModeLocal
+
+        self.__minVals = None
+        self.__maxVals = None
+
+        self.__axisDomains = None
+        # quantiles of all datasets estimated while loading and of the (filtered) data matrix
+        self.__quantilesAll = None
+        self.__quantiles    = None
+
+        # worker threads for column-wise statistics and scaling of wide relations
+        self.numWorkers   = os.cpu_count() or 1
+        self.minBlockSize = 64
+
+        self.__matrix       = None
+        self.__classCodes   = None
+        self.__classStats   = {}
+        self.__scaledMatrix = {}
+        self.__clusters     = {}
+        self.__histograms   = {}
+
+    def _emitDataChanged(self):
+        """
+        Called whenever the data or its scaling has changed. Overridden by L{data.Relation} to emit a Qt signal.
+        """
+        pass
+
+    def __getstate__(self):
+        return {
+            "relName":       self.relName,
+            "fieldNames":    self.__fieldNamesAll,
+            "columns":       self.__columns,
+            "classCodes":    self.__classCodesAll,
+            "classNames":    self.__classNames,
+            "nominalValues": self.nominalValues,
+            "rowIndices":    self.__rowIndices,
+            "activeClasses": self.activeClasses,
+            "scaleMode":     self.__scale_mode,
+            "quantiles":     self.__quantilesAll,
+            "sourceHeader":  self.sourceHeader,
+        }
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.setData(state["fieldNames"], state["columns"], state["classCodes"], state["classNames"],
+                     state["nominalValues"], state.get("quantiles"))
+        self.relName = state["relName"]
+        self.__rowIndices = state["rowIndices"]
+        self.activeClasses = state["activeClasses"]
+        self.__scale_mode = state["scaleMode"]
+        self.sourceHeader = state.get("sourceHeader")
+
+    @property
+    def fieldNames(self):
+        """
+        Getter for field names. DO NOT use direct list access operations on the returned list as it will
+        mess up data filtering. Use the setter to replace the full list instead.
+        """
+        return self.__fieldNames
+
+    @fieldNames.setter
+    def fieldNames(self, names):
+        self.__fieldNamesAll = names
+        self.__fieldNames = list(names)
+        self.__resetMatrix()
+        self._emitDataChanged()
+
+    @property
+    def datasets(self):
+        """
+        Getter for datasets as list of rows with the class name as last element. The rows are created from the
+        column storage on first access, prefer L{dataMatrix} and L{classCodes} for large relations.
+        DO NOT modify the returned list. Use the setter to replace all datasets instead.
+        """
+        if self.__datasets is None:
+            classNames, codes = self.classCodes()
+            self.__datasets = [row + [classNames[c]] for row, c in zip(self.dataMatrix().tolist(), codes.tolist())]
+        return self.__datasets
+
+    @datasets.setter
+    def datasets(self, datasets):
+        numDims = len(self.fieldNames) - 1
+        classNames = sorted(set(ds[-1] for ds in datasets))
+        lookup = {c: i for i, c in enumerate(classNames)}
+        matrix = np.array([ds[:-1] for ds in datasets], dtype=np.float64).reshape(-1, numDims)
+        codes = np.fromiter((lookup[ds[-1]] for ds in datasets), dtype=np.intp, count=len(datasets))
+        self.setData(self.__fieldNamesAll, [matrix[:, i] for i in range(numDims)], codes, classNames)
+
+    def setData(self, fieldNames, columns, classCodes, classNames, nominalValues=None, quantiles=None):
+        """
+        Replace all data of this relation.
+        All columns are copied into one column-major float matrix. Numeric columns are kept as views of
+        this matrix, nominal columns additionally keep their compact integer codes.
+
+        @param fieldNames: attribute names, class attribute last
+        @param columns: one array per non-class attribute, integer codes for nominal attributes. Numeric columns
+                        may also be iterables of chunk arrays like the columns of a L{ColumnSpool},
+                        lists of chunks are emptied while being copied
+        @param classCodes: integer array with the class of each dataset as index into classNames
+        @param classNames: list of class names
+        @param nominalValues: dict with attribute indices of nominal attributes as keys and their values as lists
+        @param quantiles: estimated quantiles L{sketchQuantiles} of all attributes as array of shape
+                          (len(sketchQuantiles), number of attributes), e.g. from the L{ColumnSpool} of a reader.
+                          If None, they are estimated when a robust scale mode needs them.
+        """
+        nominalValues = nominalValues or {}
+        matrix = self.__allocMatrix((len(classCodes), len(columns)))
+        for i, col in enumerate(columns):
+            if not isinstance(col, np.ndarray):
+                offset = 0
+                for chunk in col:
+                    matrix[offset:offset + len(chunk), i] = chunk
+                    offset += len(chunk)
+                # release chunks right away, the matrix may live on disk
+                if isinstance(col, list):
+                    col.clear()
+            else:
+                matrix[:, i] = col
+                if i in nominalValues:
+                    matrix[col == missingCode(col.dtype), i] = np.nan
+
+        self.__assignData(fieldNames, matrix, {i: columns[i] for i in nominalValues}, classCodes, classNames,
+                          nominalValues, quantiles)
+
+    def appendRows(self, columns, classCodes, classNames=None):
+        """
+        Append datasets to this relation. Class filters are reset. Cached histograms of the current scale mode
+        are updated by counting only the new datasets as long as these do not change the scale bounds, all
+        other derived data is recomputed on demand.
+
+        @param columns: one array per non-class attribute with the values of the new datasets,
+                        integer codes into L{nominalValues} for nominal attributes
+        @param classCodes: integer array with the class of each new dataset as index into the class names
+        @param classNames: list of class names if classes are added, must start with the current class names
+        """
+        classCodes = np.asarray(classCodes, dtype=np.intp)
+        classNames = self.__classNames if classNames is None else list(classNames)
+        if classNames[:len(self.__classNames)] != self.__classNames:
+            raise ValueError("New class names must extend the current class names")
+        if len(classCodes) == 0:
+            return
+
+        numRows = self.__matrixAll.shape[0]
+        nominalColumns = {}
+        new = np.empty((len(classCodes), len(columns)), dtype=np.float64)
+        for i, col in enumerate(columns):
+            if i in self.nominalValues:
+                col = np.asarray(col, dtype=self.__columns[i].dtype)
+                nominalColumns[i] = np.concatenate((self.__columns[i], col))
+                new[:, i] = col
+                new[col == missingCode(col.dtype), i] = np.nan
+            else:
+                new[:, i] = col
+
+        # histograms can only be updated if they do not depend on the filter or on quantiles of the data
+        incremental = self.__rowIndices is None and not self.clipsScaledValues and self.__minVals is not None
+        if incremental:
+            bounds = self.__scaleBounds(.1, .1)
+            minVals = np.fmin(self.__minVals, np.fmin.reduce(new, axis=0)).tolist()
+            maxVals = np.fmax(self.__maxVals, np.fmax.reduce(new, axis=0)).tolist()
+            histograms = {k: v for k, v in self.__histograms.items() if k[0] == self.__scale_mode}
+
+        matrix = self.__allocMatrix((numRows + len(new), new.shape[1]))
+
+        def copyBlock(block):
+            matrix[:numRows, block] = self.__matrixAll[:, block]
+            matrix[numRows:, block] = new[:, block]
+
+        self.__mapColumnBlocks(copyBlock, matrix)
+        self.__assignData(self.__fieldNamesAll, matrix, nominalColumns,
+                          np.concatenate((self.__classCodesAll, classCodes)), classNames, self.nominalValues,
+                          emit=False)
+
+        if incremental:
+            self.__minVals = minVals
+            self.__maxVals = maxVals
+            if histograms and np.array_equal(bounds, self.__scaleBounds(.1, .1), equal_nan=True):
+                scaled = self.scaleValues(new)
+                for key, counts in histograms.items():
+                    newClasses = len(classNames) - counts.shape[0]
+                    if newClasses > 0:
+                        counts = np.concatenate((counts, np.zeros((newClasses,) + counts.shape[1:], counts.dtype)))
+                    self.__histograms[key] = counts + self.__countHistograms(scaled, classCodes, len(classNames),
+                                                                             key[1])
+        self._emitDataChanged()
+
+    def __allocMatrix(self, shape):
+        """
+        Allocate an uninitialized column-major matrix of L{storageType}, memory-mapped if it is larger
+        than L{memoryLimit}. The backing file is anonymous and removed once the matrix is freed.
+        """
+        dtype = np.dtype(self.storageType)
+        if self.memoryLimit is None or shape[0] * shape[1] * dtype.itemsize <= self.memoryLimit \
+                or 0 in shape:
+            return np.empty(shape, dtype=dtype, order="F")
+        with tempfile.TemporaryFile(dir=self.mappedDirectory, prefix="relation-") as f:
+            return np.memmap(f, dtype=dtype, mode="w+", shape=shape, order="F")
+
+    def __mapColumnBlocks(self, func, matrix):
+        """
+        L{mapColumnBlocks} over the columns of a matrix. Blocks of memory-mapped matrices are limited
+        to L{blockBytes}, so only a few blocks are resident at any time.
+        """
+        maxBlockSize = None
+        if isinstance(matrix, np.memmap) and len(matrix):
+            maxBlockSize = max(1, self.blockBytes // (len(matrix) * matrix.dtype.itemsize))
+        return mapColumnBlocks(func, matrix.shape[1], self.numWorkers, self.minBlockSize, maxBlockSize)
+
+    @property
+    def isMapped(self):
+        """
+        Whether the data matrix is stored in a memory-mapped file.
+        """
+        return isinstance(self.__matrixAll, np.memmap)
+
+    def memoryUsage(self):
+        """
+        Size of the data and cached derived arrays of this relation.
+
+        @return: tuple of the number of bytes held in RAM and the number of bytes in memory-mapped files
+        """
+        arrays = [self.__matrixAll, self.__classCodesAll] + [self.__columns[i] for i in self.nominalValues]
+        arrays += list(self.__scaledMatrix.values())
+        if self.__matrix is not None and self.__matrix is not self.__matrixAll:
+            arrays.append(self.__matrix)
+        resident = 0
+        mapped = 0
+        seen = set()
+        for a in arrays:
+            if id(a) in seen:
+                continue
+            seen.add(id(a))
+            if isinstance(a, np.memmap):
+                mapped += a.nbytes
+            else:
+                resident += a.nbytes
+        return resident, mapped
+
+    def __assignData(self, fieldNames, matrix, nominalColumns, classCodes, classNames, nominalValues, quantiles=None,
+                     emit=True):
+        numRows = len(classCodes)
+        self.__columns = [nominalColumns[i] if i in nominalColumns else matrix[:, i] for i in range(matrix.shape[1])]
+        self.__matrixAll        = matrix
+        self.__classCodesAll    = np.asarray(classCodes, dtype=np.intp)
+        self.__classNames       = list(classNames)
+        self.__fieldNamesAll    = list(fieldNames)
+        self.__fieldNames       = list(fieldNames)
+        self.__rowIndices       = None
+        self.nominalValues      = dict(nominalValues)
+
+        counts = np.bincount(self.__classCodesAll, minlength=len(self.__classNames))
+        self.__datasetsPerClass = {c: int(counts[i]) for i, c in enumerate(self.__classNames) if counts[i] > 0}
+        self.allClasses         = set(self.__datasetsPerClass)
+        self.activeClasses      = set(self.allClasses)
+        self.numDatasets        = numRows
+
+        self.__axisDomains = None
+        self.__minVals = None
+        self.__maxVals = None
+        self.__quantilesAll = quantiles
+        self.__scaled_datasets = None
+        self.__resetMatrix()
+        if emit:
+            self._emitDataChanged()
+
+    def toSharedMemory(self):
+        """
+        Copy the data matrix and class codes into shared memory, so worker processes can attach to
+        the data with L{fromSharedMemory} without copying or unpickling it.
+
+        @return: tuple of a small picklable handle for L{fromSharedMemory} and the list of
+                 multiprocessing.shared_memory.SharedMemory blocks, which the caller has to keep open
+                 while workers use them and unlink afterwards
+        """
+        from multiprocessing import shared_memory
+
+        blocks = []
+        arrays = {}
+        for key, arr in (("matrix", self.__matrixAll), ("classCodes", self.__classCodesAll)):
+            shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+            order = "F" if key == "matrix" else "C"
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, order=order)[...] = arr
+            blocks.append(shm)
+            arrays[key] = (shm.name, arr.shape, arr.dtype.str, order)
+
+        handle = {
+            "relName":       self.relName,
+            "fieldNames":    self.__fieldNamesAll,
+            "classNames":    self.__classNames,
+            "nominalValues": self.nominalValues,
+            "nominalTypes":  {i: self.__columns[i].dtype.str for i in self.nominalValues},
+            "arrays":        arrays,
+        }
+        return handle, blocks
+
+    @classmethod
+    def fromSharedMemory(cls, handle):
+        """
+        Create a relation backed by shared memory created with L{toSharedMemory}.
+        Numeric data is not copied. Nominal codes are restored from the matrix.
+
+        @param handle: handle returned by L{toSharedMemory}
+        @return: tuple of the new relation and the list of attached SharedMemory blocks,
+                 which the caller has to keep open as long as the relation is in use
+        """
+        from multiprocessing import shared_memory
+
+        blocks = []
+        arrays = {}
+        for key, (name, shape, dtype, order) in handle["arrays"].items():
+            shm = shared_memory.SharedMemory(name=name)
+            blocks.append(shm)
+            arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, order=order)
+
+        rel = cls()
+        rel.relName = handle["relName"]
+        matrix = arrays["matrix"]
+        nominalColumns = {i: np.where(np.isnan(matrix[:, i]), missingCode(t), matrix[:, i]).astype(np.dtype(t))
+                          for i, t in handle["nominalTypes"].items()}
+        rel.__assignData(handle["fieldNames"], matrix, nominalColumns, arrays["classCodes"], handle["classNames"],
+                         handle["nominalValues"])
+        return rel, blocks
+
+    def exportState(self):
+        """
+        Export data and cached derived data (min/max values and the scaled matrix of the current
+        scale mode) for saving it in a project file.
+
+        @return: tuple of dict with NumPy arrays and dict with JSON-serializable metadata
+        """
+        arrays = {
+            "matrix":     self.__matrixAll,
+            "classCodes": self.__classCodesAll,
+        }
+        for i in self.nominalValues:
+            arrays["nominal" + str(i)] = self.__columns[i]
+        if self.__rowIndices is not None:
+            arrays["rowIndices"] = self.__rowIndices
+        if self.__minVals is not None:
+            arrays["minVals"] = np.asarray(self.__minVals)
+            arrays["maxVals"] = np.asarray(self.__maxVals)
+        if self.__quantilesAll is not None:
+            arrays["quantiles"] = self.__quantilesAll
+        scaledKey = (self.__scale_mode, .1, .1)
+        if scaledKey in self.__scaledMatrix:
+            arrays["scaled"] = self.__scaledMatrix[scaledKey]
+
+        meta = {
+            "relName":       self.relName,
+            "fieldNames":    self.__fieldNamesAll,
+            "classNames":    self.__classNames,
+            "nominalValues": {str(i): v for i, v in self.nominalValues.items()},
+            "activeClasses": sorted(self.activeClasses),
+            "scaleMode":     self.__scale_mode,
+            "sourceHeader":  self.sourceHeader,
+        }
+        return arrays, meta
+
+    def importState(self, arrays, meta):
+        """
+        Restore data and cached derived data exported with L{exportState} without recomputing anything.
+
+        @param arrays: dict with NumPy arrays. The data and scaled matrix may also be given as functions which
+                       read the matrix into a matrix created by the function passed to them, so it is stored
+                       like any other data matrix of this relation (see L{memoryLimit})
+        @param meta: dict with metadata
+        """
+        arrays = {k: v(self.__allocMatrix) if callable(v) else v for k, v in arrays.items()}
+        nominalValues = {int(i): v for i, v in meta["nominalValues"].items()}
+        nominalColumns = {i: arrays["nominal" + str(i)] for i in nominalValues}
+        self.relName = meta["relName"]
+        self.sourceHeader = meta.get("sourceHeader")
+        self.__scale_mode = meta["scaleMode"]
+        self.__assignData(meta["fieldNames"], arrays["matrix"], nominalColumns, arrays["classCodes"],
+                          meta["classNames"], nominalValues, arrays.get("quantiles"), emit=False)
+
+        self.__rowIndices = arrays.get("rowIndices")
+        self.__resetMatrix()
+        self.activeClasses = set(meta["activeClasses"])
+        if "minVals" in arrays:
+            self.__minVals = arrays["minVals"].tolist()
+            self.__maxVals = arrays["maxVals"].tolist()
+        if "scaled" in arrays:
+            self.__scaledMatrix[(self.__scale_mode, .1, .1)] = arrays["scaled"]
+        self._emitDataChanged()
+
+    def column(self, index):
+        """
+        Values of one attribute for all datasets (ignoring class filters).
+        Nominal attributes are returned as integer codes into L{nominalValues}.
+
+        @param index: attribute index
+        @return: NumPy array, must not be modified
+        """
+        return self.__columns[index]
+
+    @property
+    def axisDomains(self):
+        if self.__axisDomains is None:
+            if self.__scale_mode == self.ScaleModeLocal:
+                self.__axisDomains = list(zip(self.minVals(), self.maxVals()))
+            elif self.__scale_mode in (self.ScaleModePercentile, self.ScaleModeRobust):
+                self.__axisDomains = list(zip(*self.__scaleBounds(0, 0)))
+            else:
+                self.__axisDomains = [self.__globalMinMax()] * (len(self.fieldNames) - 1)
+
+        return self.__axisDomains
+
+    def numDatasetsForClass(self, cls):
+        return self.__datasetsPerClass.get(cls, 0)
+
+    def __globalMinMax(self):
+        # columns without any values have NaN bounds, which must not spread to all other columns
+        return float(np.fmin.reduce(self.minVals())), float(np.fmax.reduce(self.maxVals()))
+
+    def minVals(self):
+        if self.__minVals is None:
+            self.__calcMinMaxVals()
+        return self.__minVals
+
+    def maxVals(self):
+        if self.__maxVals is None:
+            self.__calcMinMaxVals()
+        return self.__maxVals
+
+    def __calcMinMaxVals(self):
+        matrix = self.dataMatrix()
+        if len(matrix) == 0:
+            return
+
+        # fmin/fmax ignore missing values (NaN) unless a column has no values at all
+        def minMax(block):
+            return np.fmin.reduce(matrix[:, block], axis=0), np.fmax.reduce(matrix[:, block], axis=0)
+
+        results = self.__mapColumnBlocks(minMax, matrix)
+        self.__minVals = np.concatenate([r[0] for r in results]).tolist()
+        self.__maxVals = np.concatenate([r[1] for r in results]).tolist()
+
+    def resetFilters(self):
+        if len(self.__fieldNames) != len(self.__fieldNamesAll):
+            self.__fieldNames = list(self.__fieldNames)
+
+        self.__rowIndices = None
+        self.activeClasses = set(self.allClasses)
+        self.__scaled_datasets = None
+        self.__resetMatrix()
+
+        self._emitDataChanged()
+
+    def setClassFilter(self, includeClasses):
+        """
+        Filter data by given class names.
+        This method is kept here for preservation, but is basically obsolete. Filtering is done by toggling the
+        visibility state of the drawn graphics items.
+
+        @param includeClasses: class names to filter by
+        """
+        includeCodes = [i for i, c in enumerate(self.__classNames) if c in includeClasses]
+        self.__rowIndices = np.flatnonzero(np.isin(self.__classCodesAll, includeCodes))
+        self.__scaled_datasets = None
+        self.__resetMatrix()
+        self.activeClasses = includeClasses
+        self._emitDataChanged()
+
+    @property
+    def scaleMode(self):
+        return self.__scale_mode
+
+    def setScaleMode(self, mode):
+        """
+        Set axis normalization/scaling mode
+        @param mode: mode, L{ScaleModeLocal}, L{ScaleModeGlobal}, L{ScaleModePercentile} or L{ScaleModeRobust}
+        """
+        if mode != self.__scale_mode and mode in (self.ScaleModeGlobal, self.ScaleModeLocal,
+                                                  self.ScaleModePercentile, self.ScaleModeRobust):
+            self.__scale_mode = mode
+            self.__scaled_datasets = None
+            self.__axisDomains = None
+            self._emitDataChanged()
+
+    def quantiles(self):
+        """
+        Estimated per-attribute quantiles L{sketchQuantiles} of all (filtered) datasets. Without class filters
+        the estimates made while parsing are used if available, otherwise the data is sketched once.
+
+        @return: NumPy array of shape (len(sketchQuantiles), number of attributes)
+        """
+        if self.__quantiles is None:
+            if self.__rowIndices is None and self.__quantilesAll is not None:
+                self.__quantiles = self.__quantilesAll
+            else:
+                matrix = self.dataMatrix()
+                self.__quantiles = sketchMatrix(matrix, self.numWorkers).quantiles(self.sketchQuantiles)
+                if self.__rowIndices is None:
+                    self.__quantilesAll = self.__quantiles
+        return self.__quantiles
+
+    @property
+    def clipsScaledValues(self):
+        """
+        Whether the current scale mode clips outliers to [0, 1].
+        """
+        return self.__scale_mode in (self.ScaleModePercentile, self.ScaleModeRobust)
+
+    def __scaleBounds(self, minOffset, maxOffset):
+        if self.clipsScaledValues:
+            lower, q1, median, q3, upper = self.quantiles()
+            minVals = np.asarray(self.minVals(), dtype=np.float64)
+            maxVals = np.asarray(self.maxVals(), dtype=np.float64)
+            if self.__scale_mode == self.ScaleModeRobust:
+                # not limited to min/max, so the median stays at the axis center
+                halfWidth = self.robustScaleWidth * (q3 - q1)
+                lower, upper = median - halfWidth, median + halfWidth
+            else:
+                lower, upper = np.maximum(lower, minVals), np.minimum(upper, maxVals)
+            # nominal attributes always show all values, constant quantile ranges fall back to min/max
+            useMinMax = ~(upper > lower)
+            useMinMax[list(self.nominalValues)] = True
+            lower = np.where(useMinMax, minVals, lower)
+            upper = np.where(useMinMax, maxVals, upper)
+            ranges = upper - lower
+            return (lower - ranges * minOffset).tolist(), (upper + ranges * maxOffset).tolist()
+
+        if self.__scale_mode == self.ScaleModeGlobal:
+            globalMin, globalMax = self.__globalMinMax()
+            minVals = [globalMin] * (len(self.fieldNames) - 1)
+            maxVals = [globalMax] * (len(self.fieldNames) - 1)
+        else:
+            minVals = self.minVals()
+            maxVals = self.maxVals()
+
+        minVals = [x - maxVals[i] * minOffset for i, x in enumerate(minVals)]
+        maxVals = [x + x * maxOffset for x in maxVals]
+        return minVals, maxVals
+
+    def getScaledDatasets(self, minOffset=.1, maxOffset=.1):
+        if self.__scaled_datasets is None:
+            scaled = self.scaledMatrix(minOffset, maxOffset).tolist()
+            self.__scaled_datasets = [row + [ds[-1]] for row, ds in zip(scaled, self.datasets)]
+
+        return self.__scaled_datasets
+
+    def scaleValues(self, values, minOffset=.1, maxOffset=.1):
+        """
+        Scale arbitrary per-attribute values (e.g. class means) the same way L{getScaledDatasets} scales datasets.
+
+        @param values: sequence or array with one value per (non-class) attribute
+        @return: NumPy array of scaled values
+        """
+        minVals, maxVals = self.__scaleBounds(minOffset, maxOffset)
+        minVals = np.asarray(minVals, dtype=np.float64)
+        maxVals = np.asarray(maxVals, dtype=np.float64)
+        scaled = (np.asarray(values, dtype=np.float64) - minVals) / (maxVals - minVals)
+        return np.clip(scaled, 0, 1) if self.clipsScaledValues else scaled
+
+    def scaleColumnValues(self, index, values, minOffset=.1, maxOffset=.1):
+        """
+        Scale values of a single attribute, e.g. the codes of nominal values.
+
+        @param index: attribute index
+        @param values: sequence or array of values
+        @return: NumPy array of scaled values
+        """
+        minVals, maxVals = self.__scaleBounds(minOffset, maxOffset)
+        scaled = (np.asarray(values, dtype=np.float64) - minVals[index]) / (maxVals[index] - minVals[index])
+        return np.clip(scaled, 0, 1) if self.clipsScaledValues else scaled
+
+    def __resetMatrix(self):
+        self.__datasets     = None
+        self.__matrix       = None
+        self.__classCodes   = None
+        self.__classStats   = {}
+        self.__scaledMatrix = {}
+        self.__clusters     = {}
+        self.__histograms   = {}
+        self.__quantiles    = None
+
+    def dataMatrix(self):
+        """
+        Attribute values of all (filtered) datasets as a 2D NumPy array without the class column.
+        Nominal attributes are represented by their codes.
+        The array is cached until the data changes and must not be modified.
+        """
+        if self.__matrix is None:
+            if self.__rowIndices is None:
+                self.__matrix = self.__matrixAll
+            else:
+                self.__matrix = self.__allocMatrix((len(self.__rowIndices), self.__matrixAll.shape[1]))
+                np.take(self.__matrixAll, self.__rowIndices, axis=0, out=self.__matrix)
+        return self.__matrix
+
+    def scaledMatrix(self, minOffset=.1, maxOffset=.1):
+        """
+        Scaled counterpart of L{dataMatrix} for the current scale mode, stored like the data matrix.
+        Wide relations are scaled in column blocks by L{numWorkers} threads.
+        The array is cached per scale mode until the data changes and must not be modified.
+        """
+        key = (self.__scale_mode, minOffset, maxOffset)
+        if key not in self.__scaledMatrix:
+            matrix = self.dataMatrix()
+            minVals, maxVals = self.__scaleBounds(minOffset, maxOffset)
+            minVals = np.asarray(minVals, dtype=np.float64)
+            ranges = np.asarray(maxVals, dtype=np.float64) - minVals
+            scaled = self.__allocMatrix(matrix.shape)
+            clip = self.clipsScaledValues
+
+            def scaleBlock(block):
+                np.subtract(matrix[:, block], minVals[block], out=scaled[:, block])
+                np.divide(scaled[:, block], ranges[block], out=scaled[:, block])
+                if clip:
+                    np.clip(scaled[:, block], 0, 1, out=scaled[:, block])
+
+            if len(matrix) > 0:
+                self.__mapColumnBlocks(scaleBlock, matrix)
+            self.__scaledMatrix[key] = scaled
+        return self.__scaledMatrix[key]
+
+    def histograms(self, numBins=32):
+        """
+        Per-class histograms of the scaled values of all (filtered) datasets over [0, 1], i.e. along a plot axis.
+        Missing values are not counted. All classes of a column block are counted by a single bincount.
+        The counts are cached per scale mode until the data or the class filter changes and updated
+        incrementally by L{appendRows}.
+
+        @param numBins: number of bins of equal width
+        @return: NumPy array of shape (number of class names, number of attributes, numBins), classes are
+                 ordered like the class names returned by L{classCodes}. Must not be modified.
+        """
+        key = (self.__scale_mode, numBins)
+        if key not in self.__histograms:
+            classNames, codes = self.classCodes()
+            self.__histograms[key] = self.__countHistograms(self.scaledMatrix(), codes, len(classNames), numBins)
+        return self.__histograms[key]
+
+    def __countHistograms(self, scaled, codes, numClasses, numBins):
+        counts = np.zeros((numClasses, scaled.shape[1], numBins), dtype=np.int64)
+
+        def countBlock(block):
+            values = scaled[:, block]
+            present = ~np.isnan(values)
+            bins = np.clip(np.where(present, values, 0) * numBins, 0, numBins - 1).astype(np.intp)
+            # one flat bin per class, column and value bin
+            width = values.shape[1]
+            flat = (codes[:, None] * width + np.arange(width)) * numBins + bins
+            blockCounts = np.bincount(flat[present], minlength=numClasses * width * numBins)
+            counts[:, block] = blockCounts.reshape(numClasses, width, numBins)
+
+        if len(scaled) > 0:
+            self.__mapColumnBlocks(countBlock, scaled)
+        return counts
+
+    def classCodes(self):
+        """
+        Class membership of all (filtered) datasets encoded as integer indices into the list of class names.
+
+        @return: tuple of class names and NumPy array of class codes
+        """
+        if self.__classCodes is None:
+            if self.__rowIndices is None:
+                codes = self.__classCodesAll
+            else:
+                codes = self.__classCodesAll[self.__rowIndices]
+            self.__classCodes = (self.__classNames, codes)
+        return self.__classCodes
+
+    def classStatistics(self, quantiles=(.25, .5, .75)):
+        """
+        Calculate per-class count, min, max, mean, standard deviation and quantiles of all attributes.
+        Datasets are grouped by class with a single sort after which all statistics are computed by vectorized
+        reductions over the contiguous class blocks. Results are cached until the data changes.
+
+        @param quantiles: quantiles in [0, 1] to compute
+        @return: dict with class names as keys and L{ClassStatistics} objects as values
+        """
+        quantiles = tuple(quantiles)
+        if quantiles not in self.__classStats:
+            matrix = self.dataMatrix()
+            classNames, codes = self.classCodes()
+            stats = {}
+
+            if len(codes) > 0:
+                order = np.argsort(codes, kind="stable")
+                sortedCodes = codes[order]
+                starts = np.concatenate(([0], np.flatnonzero(np.diff(sortedCodes)) + 1))
+                counts = np.diff(np.concatenate((starts, [len(sortedCodes)])))
+
+                shape = (len(starts), matrix.shape[1])
+                minVals = np.empty(shape)
+                maxVals = np.empty(shape)
+                means = np.empty(shape)
+                stds = np.empty(shape)
+                qVals = np.empty((len(starts), len(quantiles), matrix.shape[1]))
+
+                # column blocks are independent, so memory-mapped matrices are only read block by block
+                def blockStatistics(block):
+                    sortedMatrix = matrix[:, block][order]
+                    missing = np.isnan(sortedMatrix)
+                    hasMissing = missing.any()
+                    if hasMissing:
+                        # missing values are left out of all statistics
+                        valueCounts = np.add.reduceat(~missing, starts, axis=0, dtype=np.float64)
+                        values = np.where(missing, 0., sortedMatrix)
+                    else:
+                        valueCounts = counts[:, np.newaxis]
+                        values = sortedMatrix
+                    minVals[:, block] = np.fmin.reduceat(sortedMatrix, starts, axis=0)
+                    maxVals[:, block] = np.fmax.reduceat(sortedMatrix, starts, axis=0)
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        blockMeans = np.add.reduceat(values, starts, axis=0, dtype=np.float64) / valueCounts
+                        sqDiffs = (values - np.repeat(blockMeans, counts, axis=0)) ** 2
+                        if hasMissing:
+                            sqDiffs[missing] = 0.
+                        means[:, block] = blockMeans
+                        stds[:, block] = np.sqrt(np.add.reduceat(sqDiffs, starts, axis=0) / valueCounts)
+                    if quantiles:
+                        quantile = np.nanquantile if hasMissing else np.quantile
+                        for g, start in enumerate(starts):
+                            with warnings.catch_warnings():
+                                warnings.simplefilter("ignore", RuntimeWarning)
+                                qVals[g, :, block] = quantile(sortedMatrix[start:start + counts[g]], quantiles, axis=0)
+
+                self.__mapColumnBlocks(blockStatistics, matrix)
+
+                for g, start in enumerate(starts):
+                    cls = classNames[sortedCodes[start]]
+                    stats[cls] = ClassStatistics(cls, int(counts[g]), minVals[g], maxVals[g], means[g], stds[g],
+                                                 dict(zip(quantiles, qVals[g])))
+
+            self.__classStats[quantiles] = stats
+
+        return self.__classStats[quantiles]
+
+    def clusterDatasets(self, numClusters, batchSize=1024, numIterations=100):
+        """
+        Cluster the scaled datasets of each class separately with mini-batch k-means.
+        Results are cached per scale mode until the data changes. Use L{clusterTask} to cluster in a
+        worker thread.
+
+        @param numClusters: maximum number of clusters per class
+        @param batchSize: mini-batch size
+        @param numIterations: number of mini-batch iterations per class
+        @return: list of L{DatasetCluster} objects, member indices refer to L{datasets}
+        """
+        return self.clusterTask(numClusters, batchSize, numIterations)()
+
+    def clusterTask(self, numClusters, batchSize=1024, numIterations=100):
+        """
+        Prepare L{clusterDatasets} for a worker thread. The scaled matrix, the class codes and the cache are
+        captured when this method is called, so it must be called by the thread changing the data. The
+        returned task does not access the relation: results of a task started before the data changed
+        are returned but not cached for the new data.
+
+        @return: callable returning the list of L{DatasetCluster} objects. Its optional argument is a
+                 L{threading.Event} which cancels the clustering, the task then returns None.
+        """
+        key = (self.__scale_mode, numClusters, batchSize, numIterations)
+        cache = self.__clusters
+        if key in cache:
+            clusters = cache[key]
+            return lambda cancelled=None: clusters
+
+        scaled = self.scaledMatrix()
+        classNames, codes = self.classCodes()
+
+        def task(cancelled=None):
+            clusters = []
+            for code, cls in enumerate(classNames):
+                if cancelled is not None and cancelled.is_set():
+                    return None
+                indices = np.flatnonzero(codes == code)
+                if len(indices) == 0:
+                    continue
+                points = scaled[indices]
+                missing = np.isnan(points)
+                if missing.any():
+                    # place missing values at the attribute's class mean (or the axis center if all are missing)
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore", RuntimeWarning)
+                        fill = np.nan_to_num(np.nanmean(points, axis=0), nan=.5)
+                    points = np.where(missing, fill, points)
+                centers, labels = miniBatchKMeans(points, numClusters, batchSize, numIterations, cancelled=cancelled)
+                order = np.argsort(labels, kind="stable")
+                starts = np.searchsorted(labels[order], np.arange(len(centers) + 1))
+                for c, center in enumerate(centers):
+                    clusters.append(DatasetCluster(cls, center, indices[order[starts[c]:starts[c + 1]]]))
+            if cancelled is not None and cancelled.is_set():
+                return None
+            # the cache is replaced, not cleared, when the data changes
+            return cache.setdefault(key, clusters)
+
+        return task
+
+    def rankAttributes(self):
+        """
+        Rank attributes by how well they separate the classes, measured as the ratio of the
+        variance of the class means to the total variance of an attribute.
+
+        @return: NumPy array of attribute indices, best separating attribute first
+        """
+        stats = self.classStatistics(())
+        matrix = self.dataMatrix()
+        if not stats or len(matrix) == 0:
+            return np.arange(len(self.fieldNames) - 1)
+
+        counts = np.array([s.count for s in stats.values()], dtype=np.float64)
+        means = np.array([s.mean for s in stats.values()])
+        totalMean = np.average(means, axis=0, weights=counts)
+        betweenVar = np.average((means - totalMean) ** 2, axis=0, weights=counts)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            totalVar = np.concatenate(self.__mapColumnBlocks(
+                lambda b: np.nanvar(np.asarray(matrix[:, b], dtype=np.float64), axis=0), matrix))
+        totalVar = np.nan_to_num(totalVar)
+        betweenVar = np.nan_to_num(betweenVar)
+        scores = np.divide(betweenVar, totalVar, out=np.zeros_like(betweenVar), where=totalVar > 0)
+        return np.argsort(-scores, kind="stable")
+
+
+class SelectionMask(object):
+    """
+    Boolean mask of selected datasets, which can be shared by any number of (linked) views.
+    Every change reports the indices of the datasets whose state has changed, so views only need
+    to update the items representing these datasets.
+    """
+
+    SelectReplace = 0
+    SelectAdd     = 1
+    SelectRemove  = 2
+
+    def __init__(self, size=0):
+        super().__init__()
+        self.mask = np.zeros(size, dtype=bool)
+
+    def _emitChanged(self, changedIndices):
+        """
+        Called with the indices of all datasets whose selection state has changed.
+        Overridden by L{data.Selection} to emit a Qt signal.
+        """
+        pass
+
+    @property
+    def size(self):
+        return len(self.mask)
+
+    def resize(self, size):
+        """
+        Adjust the mask to a relation with the given number of datasets. The selection is cleared
+        if the size differs.
+        """
+        if size != len(self.mask):
+            changed = np.flatnonzero(self.mask)
+            self.mask = np.zeros(size, dtype=bool)
+            if len(changed):
+                self._emitChanged(changed)
+
+    def select(self, indices, mode=SelectReplace):
+        """
+        Change the selection.
+
+        @param indices: dataset indices
+        @param mode: L{SelectReplace}, L{SelectAdd} or L{SelectRemove}
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        if mode == self.SelectReplace:
+            mask = np.zeros_like(self.mask)
+            mask[indices] = True
+            changed = np.flatnonzero(mask != self.mask)
+        else:
+            changed = indices[self.mask[indices] != (mode == self.SelectAdd)]
+            changed = np.unique(changed)
+            mask = self.mask
+            mask[changed] = (mode == self.SelectAdd)
+
+        self.mask = mask
+        if len(changed):
+            self._emitChanged(changed)
+
+    def clear(self):
+        self.select([], self.SelectReplace)
+
+    def indices(self):
+        """
+        @return: sorted NumPy array with the indices of all selected datasets
+        """
+        return np.flatnonzero(self.mask)
+
+
+class RelationFactory(object):
+    # registered L{RelationReader} instances
+    readers = []
+    # registered L{RelationWriter} instances
+    writers = []
+
+    # class of created relations
+    relationClass = RelationData
+
+    # file name suffixes of supported compression formats
+    compressionSuffixes = tuple(suffix for _, suffix, _ in compressionFormats)
+
+    @classmethod
+    def registerReader(cls, reader):
+        """
+        Register a reader for a new input format.
+
+        @param reader: L{RelationReader} instance
+        """
+        cls.readers.append(reader)
+
+    @classmethod
+    def registerWriter(cls, writer):
+        """
+        Register a writer for a new output format.
+
+        @param writer: L{RelationWriter} instance
+        """
+        cls.writers.append(writer)
+
+    @classmethod
+    def filePatterns(cls):
+        """
+        @return: list of glob patterns for all supported files
+        """
+        patterns = []
+        for r in cls.readers:
+            for ext in r.extensions:
+                patterns.append("*" + ext)
+                patterns.extend("*" + ext + c for c in cls.compressionSuffixes)
+        return patterns
+
+    @classmethod
+    def findReader(cls, fileName):
+        """
+        Find reader for a file by its extension (ignoring compression suffixes) or by sniffing its content.
+
+        @param fileName: file name
+        @return: L{RelationReader} instance
+        """
+        name = splitCompressionSuffix(fileName)[0].lower()
+        for r in cls.readers:
+            if name.endswith(r.extensions):
+                return r
+
+        f, _ = openTextFile(fileName)
+        with f:
+            sample = f.read(8192)
+        for r in cls.readers:
+            if r.sniff(sample):
+                return r
+        raise ValueError("Unknown file format: " + fileName)
+
+    @classmethod
+    def loadFromFile(cls, fileName, **options):
+        """
+        Load a relation from a file in any registered format.
+
+        @param fileName: file name, may be gzip, bzip2 or xz compressed
+        @param options: reader options, e.g. classColumn for CSV files
+        @return: instance of L{relationClass}
+        """
+        reader = cls.findReader(fileName)
+        f, compressed = openTextFile(fileName)
+        with f:
+            lines = ThreadedLineReader(f) if compressed else f
+            try:
+                return reader.read(lines, cls.relationClass(), **options)
+            except:
+                raise Exception(reader.name + " parsing error!")
+            finally:
+                if compressed:
+                    lines.close()
+
+    @classmethod
+    def findWriter(cls, fileName):
+        """
+        Find writer for a file by its extension (ignoring compression suffixes).
+
+        @param fileName: file name
+        @return: L{RelationWriter} instance
+        """
+        name = splitCompressionSuffix(fileName)[0].lower()
+        for w in cls.writers:
+            if name.endswith(w.extensions):
+                return w
+        raise ValueError("Unknown file format: " + fileName)
+
+    @classmethod
+    def saveToFile(cls, fileName, rel, rows=None, **options):
+        """
+        Save the original values of datasets of a relation in the format given by the file extension.
+
+        @param fileName: file name, compressed if it ends with a gzip, bzip2 or xz suffix
+        @param rel: L{RelationData} instance
+        @param rows: indices into L{RelationData.dataMatrix} of the datasets to save or None for all datasets
+        @param options: writer options, e.g. delimiter for CSV files (by default chosen by the file extension)
+        """
+        writer = cls.findWriter(fileName)
+        name, opener = splitCompressionSuffix(fileName)
+        options.setdefault("delimiter", writer.delimiter(name))
+        opener = opener or open
+        with opener(fileName, "wb") as f:
+            writer.write(f, rel, rows, **options)
+
+
+RelationFactory.registerReader(ArffReader())
+RelationFactory.registerReader(CsvReader())
+RelationFactory.registerWriter(ArffWriter())
+RelationFactory.registerWriter(CsvWriter())
+
+
+class ProjectFile(object):
+    """
+    Project files store a relation together with its source file, cached derived data, a selection mask
+    and an arbitrary JSON-serializable view state in a single uncompressed NumPy .npz archive.
+    When a project is opened and its source file is unchanged, the relation is restored from the
+    archive without parsing or rescaling anything.
+    """
+
+    version = 1
+
+    @staticmethod
+    def fingerprint(fileName):
+        """
+        @return: list of size and modification time of a file or None if it does not exist
+        """
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    @staticmethod
+    def save(fileName, rel, sourceFile, viewState, selection=None, loadOptions=None):
+        """
+        Save a project file.
+
+        @param fileName: project file name
+        @param rel: L{RelationData} instance
+        @param sourceFile: file the relation was loaded from
+        @param viewState: JSON-serializable dict with the view state
+        @param selection: indices of selected datasets
+        @param loadOptions: reader options used for loading the source file
+        """
+        arrays, relMeta = rel.exportState()
+        arrays = {"rel_" + k: v for k, v in arrays.items()}
+        if selection is not None:
+            mask = np.zeros(rel.dataMatrix().shape[0], dtype=bool)
+            mask[selection] = True
+            arrays["selection"] = mask
+
+        meta = {
+            "version":     ProjectFile.version,
+            "source":      os.path.abspath(sourceFile) if sourceFile else None,
+            "fingerprint": ProjectFile.fingerprint(sourceFile) if sourceFile else None,
+            "loadOptions": loadOptions or {},
+            "relation":    relMeta,
+            "view":        viewState,
+        }
+        arrays["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+
+        with open(fileName, "wb") as f:
+            np.savez(f, **arrays)
+
+    @staticmethod
+    def readMatrix(fileName, member, allocate, blockBytes=16 * 1024 * 1024):
+        """
+        Read a column-major matrix stored in a project file block by block into a newly allocated matrix,
+        so it does not have to fit into RAM.
+
+        @param fileName: project file name
+        @param member: name of the .npy file in the archive
+        @param allocate: function returning an uninitialized matrix of a given shape
+        @param blockBytes: maximum number of bytes read at once
+        @return: matrix returned by allocate
+        """
+        with zipfile.ZipFile(fileName) as zf, zf.open(member) as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(f)
+            matrix = allocate(shape)
+            if not fortranOrder:
+                matrix[...] = np.frombuffer(f.read(), dtype=dtype).reshape(shape)
+                return matrix
+
+            colBytes = max(1, shape[0] * dtype.itemsize)
+            step = max(1, blockBytes // colBytes)
+            for start in range(0, shape[1], step):
+                stop = min(start + step, shape[1])
+                block = np.frombuffer(f.read((stop - start) * shape[0] * dtype.itemsize), dtype=dtype)
+                matrix[:, start:stop] = block.reshape((shape[0], stop - start), order="F")
+        return matrix
+
+    @staticmethod
+    def load(fileName, factory=None):
+        """
+        Open a project file. If the source file has changed since the project was saved, it is
+        loaded again and the stored selection is discarded. If it is missing, the stored data is used.
+
+        @param fileName: project file name
+        @param factory: L{RelationFactory} (sub)class for creating the relation
+        @return: tuple of relation, source file name, view state dict and indices of selected datasets
+        """
+        factory = factory or RelationFactory
+        with np.load(fileName, allow_pickle=False) as npz:
+            meta = json.loads(bytes(npz["meta"]).decode("utf-8"))
+            if meta["version"] > ProjectFile.version:
+                raise ValueError("Unsupported project file version")
+
+            source = meta["source"]
+            fingerprint = ProjectFile.fingerprint(source) if source else None
+            if fingerprint is not None and fingerprint != meta["fingerprint"]:
+                rel = factory.loadFromFile(source, **meta["loadOptions"])
+                rel.setScaleMode(meta["relation"]["scaleMode"])
+                selection = np.empty(0, dtype=np.intp)
+            else:
+                # large matrices are read straight into the storage of the relation
+                arrays = {k[4:]: npz[k] for k in npz.files if k.startswith("rel_") and k[4:] not in ("matrix", "scaled")}
+                for key in ("matrix", "scaled"):
+                    if "rel_" + key in npz.files:
+                        arrays[key] = functools.partial(ProjectFile.readMatrix, fileName, "rel_" + key + ".npy")
+                rel = factory.relationClass()
+                rel.importState(arrays, meta["relation"])
+                selection = np.flatnonzero(npz["selection"]) if "selection" in npz.files else np.empty(0, np.intp)
+
+        return rel, source, meta["view"], selection
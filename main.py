@@ -20,15 +20,17 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import time
+startTime = time.perf_counter()
+
 import sys
 from traceback import print_exception
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import QColor, QPalette, QFontMetrics, QImage, QPainter, QDesktopServices
-from PyQt5.QtCore import Qt, QSize, QUrl
+from PyQt5.QtWidgets import QApplication, QWidget, QHBoxLayout, QVBoxLayout, QPushButton, QCheckBox, QLabel, \
+    QGroupBox, QProgressBar, QComboBox, QSpinBox, QColorDialog, QFileDialog, QMessageBox, QDesktopWidget
+from PyQt5.QtGui import QColor, QPalette, QFontMetrics
+from PyQt5.QtCore import Qt, QSize, QUrl, QObject, QEvent, QTimer
 import os.path
-import data
-from vis import StarPlot
-from data import Relation
+from vis import StarPlot, GlyphGrid
 
 
 class WekaVisualizer(QWidget):
@@ -51,27 +53,41 @@ class WekaVisualizer(QWidget):
         self.globalLayout         = QHBoxLayout()
         self.controlLayout        = QVBoxLayout()
         self.dynamicControlLayout = QVBoxLayout()
-        self.plotLayout           = QVBoxLayout()
+        self.plotLayout           = QHBoxLayout()
         self.plot                 = StarPlot()
+        # additional views sharing relation, selection and styles with the main plot
+        self.linkedViews          = []
 
-        self.colorDialog = QColorDialog()
-        self.colorDialog.setOption(QColorDialog.ShowAlphaChannel, True)
+        self.__colorDialog = None
 
         self.activeSwatch = None
+        # file the current relation was loaded from
+        self.sourceFile   = None
 
         self.selectionStatBars = []
 
         self.initUI()
 
+    @property
+    def colorDialog(self):
+        # created on first use to speed up start-up
+        if self.__colorDialog is None:
+            self.__colorDialog = QColorDialog()
+            self.__colorDialog.setOption(QColorDialog.ShowAlphaChannel, True)
+        return self.__colorDialog
+
     def initUI(self):
         self.resize(1024, 768)
         self.center()
         self.setWindowTitle(self.tr("WEKA Visualizer"))
 
-        loadButton = QPushButton(self.tr("Load ARFF"))
+        loadButton = QPushButton(self.tr("Load data"))
         loadButton.clicked.connect(self.showInputFileDialog)
+        openProjectButton = QPushButton(self.tr("Open project"))
+        openProjectButton.clicked.connect(self.showOpenProjectDialog)
 
         self.controlLayout.addWidget(loadButton)
+        self.controlLayout.addWidget(openProjectButton)
         self.controlLayout.addLayout(self.dynamicControlLayout)
         self.controlLayout.addStretch(1)
 
@@ -84,16 +100,16 @@ class WekaVisualizer(QWidget):
 
         self.show()
 
-    def addControlArea(self):
+    def addControlArea(self, palette=None):
         # clear layout first
         for i in reversed(range(self.dynamicControlLayout.count())):
             self.dynamicControlLayout.itemAt(i).widget().setParent(None)
 
-        self._addPlotControls()
+        self._addPlotControls(palette)
         self._addPlotSelectionStats()
         self._addOptions()
 
-    def _addPlotControls(self):
+    def _addPlotControls(self, palette=None):
         # classes selector
         groupClasses = QGroupBox(self.tr("Classes"))
         classesVBox = QVBoxLayout()
@@ -119,6 +135,8 @@ class WekaVisualizer(QWidget):
             swatch.setFixedSize(QSize(30, 30))
             swatch.clicked.connect(self.selectClassColor)
             color = self.defaultPalette[i % len(self.defaultPalette)]
+            if palette is not None and c in palette:
+                color = palette[c]
             self._plotPalette[c] = color
             self._setSwatchColor(swatch, color)
             hbox.addWidget(swatch)
@@ -132,6 +150,9 @@ class WekaVisualizer(QWidget):
 
             classesVBox.addLayout(hbox)
 
+            if c not in self.plot.activeClasses:
+                checkBox.setChecked(False)
+
         self.plot.setPlotPalette(self._plotPalette)
         self.dynamicControlLayout.addWidget(groupClasses)
 
@@ -186,8 +207,15 @@ class WekaVisualizer(QWidget):
 
     def updateSelectionStats(self):
         highlightsPerClass = {}
-        for s in self.plot.highlightedRings:
-            highlightsPerClass[s.dataClassLabel] = highlightsPerClass.get(s.dataClassLabel, 0) + 1
+        import numpy as np
+        classNames, codes = self.plot.relation.classCodes()
+        mask = self.plot.selection.mask
+        if len(mask) == len(codes):
+            counts = np.bincount(codes[mask], minlength=len(classNames))
+        else:
+            counts = np.zeros(len(classNames), dtype=np.intp)
+        for i, c in enumerate(classNames):
+            highlightsPerClass[c] = int(counts[i])
 
         for b in self.selectionStatBars:
             num = self.plot.relation.numDatasetsForClass(b.dataClassLabel)
@@ -210,17 +238,78 @@ class WekaVisualizer(QWidget):
         groupOpts.setLayout(optsVBox)
 
         # feature scaling
+        rel = self.plot.relation
         scaleHBox = QHBoxLayout()
         scaleHBox.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-        scaleOpt = QCheckBox()
-        scaleOpt.setChecked(True)
-        scaleOpt.stateChanged.connect(self.toggleScaleMode)
-        scaleLabel = QLabel(self.tr("&Scale features"))
+        scaleOpt = QComboBox()
+        scaleOpt.addItem(self.tr("Min/max per axis"), rel.ScaleModeLocal)
+        scaleOpt.addItem(self.tr("Global min/max"), rel.ScaleModeGlobal)
+        scaleOpt.addItem(self.tr("1st-99th percentile"), rel.ScaleModePercentile)
+        scaleOpt.addItem(self.tr("Median/IQR"), rel.ScaleModeRobust)
+        scaleOpt.setCurrentIndex(scaleOpt.findData(rel.scaleMode))
+        scaleOpt.currentIndexChanged.connect(self.setScaleMode)
+        scaleLabel = QLabel(self.tr("&Scaling"))
         scaleLabel.setBuddy(scaleOpt)
-        scaleHBox.addWidget(scaleOpt)
         scaleHBox.addWidget(scaleLabel)
+        scaleHBox.addWidget(scaleOpt)
         optsVBox.addLayout(scaleHBox)
 
+        # plot mode
+        modeHBox = QHBoxLayout()
+        modeHBox.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        modeOpt = QComboBox()
+        modeOpt.addItem(self.tr("Datasets"), StarPlot.PlotModeRecords)
+        modeOpt.addItem(self.tr("Class centroids"), StarPlot.PlotModeCentroids)
+        modeOpt.addItem(self.tr("Clusters"), StarPlot.PlotModeClusters)
+        modeOpt.setCurrentIndex(modeOpt.findData(self.plot.plotMode))
+        modeOpt.currentIndexChanged.connect(self.setPlotMode)
+        modeLabel = QLabel(self.tr("Plot &mode"))
+        modeLabel.setBuddy(modeOpt)
+        modeHBox.addWidget(modeLabel)
+        modeHBox.addWidget(modeOpt)
+        optsVBox.addLayout(modeHBox)
+
+        # drawing of missing values
+        missingHBox = QHBoxLayout()
+        missingHBox.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        missingOpt = QComboBox()
+        missingOpt.addItem(self.tr("Skip"), StarPlot.MissingValuesSkip)
+        missingOpt.addItem(self.tr("Leave gap"), StarPlot.MissingValuesGap)
+        missingOpt.setCurrentIndex(missingOpt.findData(self.plot.missingValueMode))
+        missingOpt.currentIndexChanged.connect(self.setMissingValueMode)
+        missingLabel = QLabel(self.tr("Missing &values"))
+        missingLabel.setBuddy(missingOpt)
+        missingHBox.addWidget(missingLabel)
+        missingHBox.addWidget(missingOpt)
+        optsVBox.addLayout(missingHBox)
+
+        # per-class histograms along the axes
+        histogramOpt = QCheckBox(self.tr("Axis &histograms"))
+        histogramOpt.setChecked(self.plot.showHistograms)
+        histogramOpt.toggled.connect(self.setShowHistograms)
+        optsVBox.addWidget(histogramOpt)
+
+        # maximum number of axes, the remaining attributes are ranked by class separation
+        numDims = len(self.plot.relation.fieldNames) - 1
+        axesHBox = QHBoxLayout()
+        axesHBox.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        axesOpt = QSpinBox()
+        axesOpt.setRange(min(3, numDims), numDims)
+        axesOpt.setValue(min(self.plot.maxAxes or numDims, numDims))
+        axesOpt.setKeyboardTracking(False)
+        axesOpt.valueChanged.connect(self.plot.setMaxAxes)
+        axesLabel = QLabel(self.tr("Max. &axes"))
+        axesLabel.setBuddy(axesOpt)
+        axesHBox.addWidget(axesLabel)
+        axesHBox.addWidget(axesOpt)
+        optsVBox.addLayout(axesHBox)
+
+        # size of the relation in RAM and in memory-mapped files
+        self.memoryLabel = QLabel()
+        optsVBox.addWidget(self.memoryLabel)
+        self.plot.relation.dataChanged.connect(self.updateMemoryUsage)
+        self.updateMemoryUsage()
+
         self.dynamicControlLayout.addWidget(groupOpts)
 
         # save button
@@ -228,8 +317,48 @@ class WekaVisualizer(QWidget):
         saveButton.clicked.connect(self.saveImage)
         self.dynamicControlLayout.addWidget(saveButton)
 
-    def toggleScaleMode(self, state):
-        self.plot.relation.setScaleMode(Relation.ScaleModeLocal if state != Qt.Unchecked else Relation.ScaleModeGlobal)
+        linkedViewButton = QPushButton(self.tr("Add linked view"))
+        linkedViewButton.clicked.connect(lambda: self.addLinkedView(StarPlot))
+        self.dynamicControlLayout.addWidget(linkedViewButton)
+
+        glyphGridButton = QPushButton(self.tr("Add glyph grid"))
+        glyphGridButton.clicked.connect(lambda: self.addLinkedView(GlyphGrid))
+        self.dynamicControlLayout.addWidget(glyphGridButton)
+
+        saveProjectButton = QPushButton(self.tr("Save project"))
+        saveProjectButton.clicked.connect(self.showSaveProjectDialog)
+        self.dynamicControlLayout.addWidget(saveProjectButton)
+
+        exportSelectionButton = QPushButton(self.tr("Export selection"))
+        exportSelectionButton.clicked.connect(lambda: self.showExportDialog(False))
+        self.dynamicControlLayout.addWidget(exportSelectionButton)
+
+        exportClassesButton = QPushButton(self.tr("Export visible classes"))
+        exportClassesButton.clicked.connect(lambda: self.showExportDialog(True))
+        self.dynamicControlLayout.addWidget(exportClassesButton)
+
+    def setScaleMode(self, index):
+        self.plot.relation.setScaleMode(self.sender().itemData(index))
+
+    def updateMemoryUsage(self):
+        resident, mapped = self.plot.relation.memoryUsage()
+        text = self.tr("Memory: {:.1f} MiB").format(resident / 2 ** 20)
+        if mapped:
+            text += self.tr(" + {:.1f} MiB mapped").format(mapped / 2 ** 20)
+        self.memoryLabel.setText(text)
+
+    def setPlotMode(self, index):
+        self.plot.setPlotMode(self.sender().itemData(index))
+
+    def setMissingValueMode(self, index):
+        for view in [self.plot] + self.linkedViews:
+            if isinstance(view, StarPlot):
+                view.setMissingValueMode(self.sender().itemData(index))
+
+    def setShowHistograms(self, show):
+        for view in [self.plot] + self.linkedViews:
+            if isinstance(view, StarPlot):
+                view.setShowHistograms(show)
 
     def selectClassColor(self):
         s = self.sender()
@@ -244,12 +373,50 @@ class WekaVisualizer(QWidget):
 
             className = self.activeSwatch.dataClassLabel
             self._plotPalette[className] = color
-            self.plot.setPlotPalette(self._plotPalette)
+            for view in [self.plot] + self.linkedViews:
+                view.setClassColor(className, color)
+
+    def addLinkedView(self, viewClass=StarPlot):
+        """
+        Add another view of the current relation next to the main plot. All views share one
+        relation with its scaled data cache, one selection and one style table.
+
+        @param viewClass: L{StarPlot} or L{GlyphGrid}
+        """
+        view = viewClass()
+        view.setStyleTable(self.plot.styles)
+        view.setSelection(self.plot.selection)
+        view.setRelation(self.plot.relation)
+        view.plotMode = self.plot.plotMode
+        view.maxAxes  = self.plot.maxAxes
+        view.setPlotPalette(self._plotPalette)
+        view.updateWidget()
+        self.linkedViews.append(view)
+        self.plotLayout.addWidget(view)
+
+    def removeLinkedViews(self):
+        for view in self.linkedViews:
+            view.stopWorkers()
+            view.setParent(None)
+            view.deleteLater()
+        self.linkedViews.clear()
+
+    def stopWorkers(self):
+        """
+        Stop the worker threads of all views, called before the application quits.
+        """
+        for view in [self.plot] + self.linkedViews:
+            view.stopWorkers()
+
+    def closeEvent(self, event):
+        self.stopWorkers()
+        super().closeEvent(event)
 
     def saveImage(self):
         fileName = QFileDialog.getSaveFileName(self, self.tr("Select save location"),
                                                "", self.tr("Images (*.png *.jpg *.bmp *.xpm)"))
         if "" != fileName[0] and os.path.isdir(os.path.dirname(fileName[0])):
+            from PyQt5.QtGui import QImage, QPainter, QDesktopServices
             imgSize = QSize(self.plot.scene().width() * 4, self.plot.scene().height() * 4)
             img = QImage(imgSize, QImage.Format_ARGB32)
             img.fill(Qt.transparent)
@@ -266,22 +433,119 @@ class WekaVisualizer(QWidget):
         self.move(qr.topLeft())
 
     def showInputFileDialog(self):
-        fileName = QFileDialog.getOpenFileName(self, self.tr("Select WEKA ARFF file"),
-                                               "", self.tr("WEKA Files (*.arff)"))
+        import datacore
+        fileName = QFileDialog.getOpenFileName(self, self.tr("Select WEKA ARFF or CSV file"),
+                                               "", self.tr("Data Files ({});;All Files (*)").format(
+                                                   " ".join(datacore.RelationFactory.filePatterns())))
         if "" != fileName[0] and os.path.isfile(fileName[0]):
+            import data
             try:
                 rel = data.RelationFactory.loadFromFile(fileName[0])
                 if len(rel.fieldNames) == 0:
                     raise Exception("No fields")
             except:
                 QMessageBox.critical(self, self.tr("Input file error"),
-                                     self.tr("The specified input file is either not a valid WEKA ARFF file or "
-                                             "does not contain any NUMERIC columns"), QMessageBox.Ok)
+                                     self.tr("The specified input file is either not a valid WEKA ARFF or CSV file or "
+                                             "does not contain any NUMERIC or nominal columns"), QMessageBox.Ok)
                 return
 
+            self.sourceFile = fileName[0]
+            self.removeLinkedViews()
             self.plot.setRelation(rel)
             self.addControlArea()
             self.plot.updateWidget()
+            self.updateMemoryUsage()
+
+    def showSaveProjectDialog(self):
+        fileName = QFileDialog.getSaveFileName(self, self.tr("Save project"), "",
+                                               self.tr("Projects (*.wvp)"))
+        if "" != fileName[0] and os.path.isdir(os.path.dirname(fileName[0])):
+            import datacore
+            datacore.ProjectFile.save(fileName[0], self.plot.relation, self.sourceFile, self.plot.viewState(),
+                                      self.plot.selectedRecords())
+
+    def showExportDialog(self, visibleClasses=False):
+        """
+        Export the original values of the selected datasets or of all datasets of the visible classes.
+
+        @param visibleClasses: export the visible classes instead of the selection
+        """
+        import datacore
+        import numpy as np
+        writers = datacore.RelationFactory.writers
+        filters = [self.tr("{} files ({})").format(w.name, " ".join("*" + e for e in w.extensions)) for w in writers]
+        fileName, selectedFilter = QFileDialog.getSaveFileName(self, self.tr("Export datasets"), "",
+                                                               ";;".join(filters))
+        if "" == fileName or not os.path.isdir(os.path.dirname(fileName)):
+            return
+
+        try:
+            datacore.RelationFactory.findWriter(fileName)
+        except ValueError:
+            fileName += writers[filters.index(selectedFilter) if selectedFilter in filters else 0].extensions[0]
+
+        rel = self.plot.relation
+        if visibleClasses:
+            classNames, codes = rel.classCodes()
+            visibleCodes = [i for i, c in enumerate(classNames) if c in self.plot.activeClasses]
+            rows = np.flatnonzero(np.isin(codes, visibleCodes))
+        else:
+            rows = self.plot.selectedRecords()
+        try:
+            datacore.RelationFactory.saveToFile(fileName, rel, rows)
+        except (OSError, ValueError) as e:
+            # ValueError includes encoding errors of names and values
+            QMessageBox.critical(self, self.tr("Export error"),
+                                 self.tr("The datasets could not be written to the specified file:\n{}").format(e),
+                                 QMessageBox.Ok)
+
+    def showOpenProjectDialog(self):
+        fileName = QFileDialog.getOpenFileName(self, self.tr("Open project"), "",
+                                               self.tr("Projects (*.wvp);;All Files (*)"))
+        if "" != fileName[0] and os.path.isfile(fileName[0]):
+            self.openProject(fileName[0])
+
+    def openProject(self, fileName):
+        """
+        Restore data, view state and selection from a project file.
+
+        @param fileName: project file name
+        """
+        import data
+        import datacore
+        try:
+            rel, sourceFile, viewState, selection = datacore.ProjectFile.load(fileName, data.RelationFactory)
+        except Exception:
+            QMessageBox.critical(self, self.tr("Project file error"),
+                                 self.tr("The specified file is not a valid project file or its data "
+                                         "file could not be loaded"), QMessageBox.Ok)
+            return
+
+        self.sourceFile = sourceFile
+        self.removeLinkedViews()
+        self.plot.setRelation(rel)
+        self.plot.restoreViewState(viewState)
+        self.addControlArea(StarPlot.viewStatePalette(viewState))
+        self.plot.selectRecords(selection)
+
+
+class FirstFrameTimer(QObject):
+    """
+    Print the time from program start to the first paint event of a widget, which owns the timer.
+    """
+
+    def __init__(self, widget, quitAfterFrame=False):
+        super().__init__(widget)
+        self.quitAfterFrame = quitAfterFrame
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            obj.removeEventFilter(self)
+            print("Time to first frame: {:.1f} ms".format((time.perf_counter() - startTime) * 1000), file=sys.stderr)
+            if self.quitAfterFrame:
+                QTimer.singleShot(0, QApplication.quit)
+        return False
 
 
 # override excepthook to correctly show tracebacks in PyCharm
@@ -291,8 +555,25 @@ def excepthook(extype, value, traceback):
 
 sys.excepthook = excepthook
 
-if __name__ == '__main__':
+
+def main():
     app = QApplication(sys.argv)
+    # --memory-limit=MB: store larger relations in memory-mapped files, --float32: reduced precision storage
+    memoryLimit = [a.split("=", 1)[1] for a in sys.argv if a.startswith("--memory-limit=")]
+    if memoryLimit or "--float32" in sys.argv:
+        import datacore
+        if memoryLimit:
+            datacore.RelationData.memoryLimit = int(float(memoryLimit[-1]) * 2 ** 20)
+        if "--float32" in sys.argv:
+            datacore.RelationData.storageType = datacore.np.float32
     vis = WekaVisualizer()
+    app.aboutToQuit.connect(vis.stopWorkers)
+    # --startup-time: report time to first frame, --startup-time-quit: also quit afterwards (for benchmarks)
+    if "--startup-time" in sys.argv or "--startup-time-quit" in sys.argv:
+        FirstFrameTimer(vis, "--startup-time-quit" in sys.argv)
     sys.exit(app.exec_())
 
+
+if __name__ == '__main__':
+    main()
+
@@ -21,6 +21,4 @@
 from main import *
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    vis = WekaVisualizer()
-    sys.exit(app.exec_())
+    main()
@@ -0,0 +1,330 @@
+# Copyright (c) 2016 Janek Bevendorff
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""
+Tests of the Qt-independent data core.
+"""
+
+import bz2
+import gzip
+import lzma
+import math
+import warnings
+
+import numpy as np
+import pytest
+
+import datacore
+from datacore import RelationData, RelationFactory, QuantileSketch, SelectionMask, PointGridIndex, ProjectFile
+
+ARFF = """% test relation
+@RELATION test
+
+@ATTRIBUTE a NUMERIC
+@ATTRIBUTE b REAL
+@ATTRIBUTE n {'x,y', 'it\\'s', plain}
+@ATTRIBUTE s STRING
+@ATTRIBUTE cls {p, 'q r'}
+
+@DATA
+1.5,-2,'x,y','text',p
+?,0.125,'it\\'s','a, b','q r'
+3,1e-07,plain,c,p
+4,12345678,?,d,?
+"""
+
+
+def randomRelation(numRows=500, numCols=200, numClasses=3, seed=1):
+    rng = np.random.RandomState(seed)
+    columns = [rng.standard_normal(numRows) * (i + 1) + i for i in range(numCols)]
+    for col in columns[::7]:
+        col[rng.randint(0, numRows, numRows // 10)] = np.nan
+    # one column without any values
+    columns[3][:] = np.nan
+    rel = RelationData()
+    rel.setData(["a{}".format(i) for i in range(numCols)] + ["class"], columns,
+                rng.randint(0, numClasses, numRows), ["c{}".format(i) for i in range(numClasses)])
+    return rel
+
+
+@pytest.fixture
+def arffFile(tmp_path):
+    fileName = tmp_path / "test.arff"
+    fileName.write_text(ARFF)
+    return str(fileName)
+
+
+@pytest.mark.parametrize("scaleMode", [RelationData.ScaleModeGlobal, RelationData.ScaleModeLocal,
+                                       RelationData.ScaleModePercentile, RelationData.ScaleModeRobust])
+def test_parallel_scaling_matches_serial(scaleMode):
+    serial = randomRelation()
+    serial.numWorkers = 1
+    parallel = randomRelation()
+    parallel.numWorkers = 4
+    parallel.minBlockSize = 8
+    for rel in (serial, parallel):
+        rel.setScaleMode(scaleMode)
+
+    np.testing.assert_array_equal(serial.scaledMatrix(), parallel.scaledMatrix())
+    np.testing.assert_array_equal(serial.histograms(), parallel.histograms())
+    statsSerial = serial.classStatistics()
+    statsParallel = parallel.classStatistics()
+    for cls in statsSerial:
+        np.testing.assert_array_equal(statsSerial[cls].mean, statsParallel[cls].mean)
+        np.testing.assert_array_equal(statsSerial[cls].quantile(.5), statsParallel[cls].quantile(.5))
+
+
+def test_all_missing_column_keeps_other_bounds():
+    rel = randomRelation()
+    rel.setScaleMode(rel.ScaleModeGlobal)
+    scaled = rel.scaledMatrix()
+    assert np.isnan(scaled[:, 3]).all()
+    assert np.isfinite(scaled[:, 1]).all()
+
+
+def test_robust_mode_centers_median():
+    rel = randomRelation(numRows=2000, numCols=5)
+    rel.setScaleMode(rel.ScaleModeRobust)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(rel.dataMatrix(), axis=0)
+    assert np.allclose(rel.scaleValues(median)[[0, 1, 2, 4]], .5, atol=.01)
+
+
+def test_quantile_sketch_error_bound():
+    rng = np.random.RandomState(2)
+    values = rng.permutation(200000).astype(np.float64).reshape(-1, 2)
+    values[::50, 1] = np.nan
+    capacity = 256
+
+    # sketch two halves separately and merge them like the chunks of a parallel reader
+    sketch = QuantileSketch(2, capacity)
+    other = QuantileSketch(2, capacity)
+    sketch.update(values[:len(values) // 2])
+    other.updateColumns(values[len(values) // 2:].T)
+    sketch.merge(other)
+    assert sketch.count == len(values)
+
+    qs = (.01, .25, .5, .75, .99)
+    estimates = sketch.quantiles(qs)
+    maxError = 2 * math.log2(len(values) / capacity) / capacity
+    for col in range(2):
+        present = np.sort(values[:, col][~np.isnan(values[:, col])])
+        for q, estimate in zip(qs, estimates[:, col]):
+            rank = np.searchsorted(present, estimate) / len(present)
+            assert abs(rank - q) <= maxError
+
+
+def test_quantile_sketch_without_values():
+    sketch = QuantileSketch(3)
+    assert np.isnan(sketch.quantiles((.5,))).all()
+    sketch.update(np.full((10, 3), np.nan))
+    assert np.isnan(sketch.quantiles((.5,))).all()
+
+
+def test_read_arff(arffFile):
+    rel = RelationFactory.loadFromFile(arffFile)
+    assert rel.fieldNames == ["a", "b", "n", "cls"]
+    assert rel.nominalValues == {2: ["x,y", "it's", "plain"]}
+    classNames, codes = rel.classCodes()
+    assert [classNames[c] for c in codes] == ["p", "q r", "p", "?"]
+    np.testing.assert_array_equal(rel.dataMatrix(), [[1.5, -2, 0], [np.nan, .125, 1], [3, 1e-7, 2],
+                                                     [4, 12345678, np.nan]])
+
+
+@pytest.mark.parametrize("opener, suffix", [(gzip.open, ".gz"), (bz2.open, ".bz2"), (lzma.open, ".xz")])
+def test_read_compressed(tmp_path, arffFile, opener, suffix):
+    csv = "x;y;label\n1;2;u\n3;?;v\n5;6;u\n"
+    (tmp_path / "plain.csv").write_text(csv)
+    with opener(str(tmp_path / ("data.csv" + suffix)), "wt") as f:
+        f.write(csv)
+    with open(arffFile, "rb") as f, opener(arffFile + suffix, "wb") as g:
+        g.write(f.read())
+
+    for plain, compressed in ((str(tmp_path / "plain.csv"), str(tmp_path / ("data.csv" + suffix))),
+                              (arffFile, arffFile + suffix)):
+        expected = RelationFactory.loadFromFile(plain)
+        rel = RelationFactory.loadFromFile(compressed)
+        assert rel.fieldNames == expected.fieldNames
+        np.testing.assert_array_equal(rel.dataMatrix(), expected.dataMatrix())
+        assert rel.classCodes()[0] == expected.classCodes()[0]
+
+
+def test_read_csv(tmp_path):
+    fileName = tmp_path / "data.tsv"
+    fileName.write_text("label\tx\tname\ny\t1.5\tfoo\nn\t\tbar\ny\t-3\tfoo\n")
+    rel = RelationFactory.loadFromFile(str(fileName), classColumn="label")
+    assert rel.fieldNames == ["x", "name", "label"]
+    assert rel.nominalValues[1] == ["foo", "bar"]
+    np.testing.assert_array_equal(rel.dataMatrix()[:, 0], [1.5, np.nan, -3])
+    classNames, codes = rel.classCodes()
+    assert [classNames[c] for c in codes] == ["y", "n", "y"]
+
+
+def test_read_csv_spilled_to_disk(tmp_path):
+    rng = np.random.RandomState(3)
+    values = rng.standard_normal((5000, 3)).round(6)
+    fileName = tmp_path / "data.csv"
+    with open(str(fileName), "w") as f:
+        f.write("a,b,c,label\n")
+        for row in values:
+            f.write("{},{},{},l\n".format(*row))
+    rel = RelationData()
+    rel.memoryLimit = 1024
+    with open(str(fileName)) as f:
+        RelationFactory.findReader(str(fileName)).read(f, rel)
+    assert isinstance(rel.dataMatrix(), np.memmap)
+    np.testing.assert_array_equal(rel.dataMatrix(), values)
+
+
+@pytest.mark.parametrize("fileName", ["out.arff", "out.csv", "out.tsv.gz", "out.arff.bz2", "out.csv.xz"])
+def test_writer_round_trip(tmp_path, arffFile, fileName):
+    rel = RelationFactory.loadFromFile(arffFile)
+    fileName = str(tmp_path / fileName)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        RelationFactory.saveToFile(fileName, rel)
+    # the STRING attribute is not loaded and written as missing values
+    assert len(caught) == 1
+
+    copy = RelationFactory.loadFromFile(fileName, classColumn="cls")
+    if ".csv" in fileName or ".tsv" in fileName:
+        # CSV files have no attribute types, the missing STRING values become a nominal attribute
+        assert copy.fieldNames == ["a", "b", "n", "s", "cls"]
+        assert np.isnan(copy.dataMatrix()[:, 3]).all()
+        matrix = np.delete(copy.dataMatrix(), 3, axis=1)
+    else:
+        assert copy.fieldNames == rel.fieldNames
+        matrix = copy.dataMatrix()
+    np.testing.assert_array_equal(matrix, rel.dataMatrix())
+    classNames, codes = rel.classCodes()
+    copyNames, copyCodes = copy.classCodes()
+    assert [copyNames[c] for c in copyCodes] == [classNames[c] for c in codes]
+
+
+def test_writer_keeps_declarations_and_rows(tmp_path, arffFile):
+    rel = RelationFactory.loadFromFile(arffFile)
+    fileName = str(tmp_path / "out.arff")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        RelationFactory.saveToFile(fileName, rel, rows=[2, 0])
+    with open(fileName) as f:
+        text = f.read()
+    declarations = [l for l in ARFF.splitlines() if l.startswith("@ATTRIBUTE")]
+    assert [l for l in text.splitlines() if l.startswith("@ATTRIBUTE")] == declarations
+    assert text.split("@DATA\n")[1].split() == ["3,1e-07,plain,?,p", "1.5,-2,'x,y',?,p"]
+
+
+def test_format_floats_round_trip():
+    rng = np.random.RandomState(4)
+    values = np.concatenate((rng.standard_normal(1000) * 10. ** rng.randint(-8, 12, 1000),
+                             np.arange(-50, 50), [np.nan, 0., -0., 1e300]))
+    fields = datacore.formatFloats(values, b"?")
+    text = [bytes(row[valid]).decode() for row, valid in zip(*fields)]
+    parsed = np.array([np.nan if t == "?" else float(t) for t in text])
+    np.testing.assert_array_equal(parsed, values)
+
+
+class RecordingMask(SelectionMask):
+    def __init__(self, size):
+        super().__init__(size)
+        self.changes = []
+
+    def _emitChanged(self, changedIndices):
+        self.changes.append(sorted(np.asarray(changedIndices).tolist()))
+
+
+def test_selection_mask():
+    mask = RecordingMask(6)
+    mask.select([1, 3])
+    mask.select([3, 4], mask.SelectAdd)
+    mask.select([1, 5], mask.SelectRemove)
+    assert mask.indices().tolist() == [3, 4]
+    assert mask.changes == [[1, 3], [4], [1]]
+
+    mask.select([4, 5])
+    assert mask.changes[-1] == [3, 5]
+    mask.resize(6)
+    assert mask.indices().tolist() == [4, 5]
+    mask.resize(3)
+    assert mask.size == 3 and len(mask.indices()) == 0
+    assert mask.changes[-1] == [4, 5]
+    mask.clear()
+    assert len(mask.changes) == 5
+
+
+def test_point_grid_index():
+    rng = np.random.RandomState(5)
+    points = rng.uniform(-100, 100, (2000, 2))
+    index = PointGridIndex(points, cellSize=5)
+    for x, y in rng.uniform(-150, 150, (200, 2)):
+        distances = np.hypot(points[:, 0] - x, points[:, 1] - y)
+        i, d = index.nearest(x, y)
+        assert d == pytest.approx(distances.min()) and distances[i] == pytest.approx(d)
+        i, d = index.nearest(x, y, maxDistance=3)
+        if distances.min() <= 3:
+            assert d == pytest.approx(distances.min())
+        else:
+            assert (i, d) == (-1, math.inf)
+    assert PointGridIndex(np.empty((0, 2))).nearest(0, 0) == (-1, math.inf)
+
+
+def test_project_file_round_trip(tmp_path, arffFile):
+    rel = RelationFactory.loadFromFile(arffFile)
+    rel.setScaleMode(rel.ScaleModePercentile)
+    scaled = rel.scaledMatrix()
+    projectFile = str(tmp_path / "test.wvp")
+    ProjectFile.save(projectFile, rel, arffFile, {"plotMode": 1}, selection=[1, 3])
+
+    copy, source, viewState, selection = ProjectFile.load(projectFile)
+    assert source == arffFile
+    assert viewState == {"plotMode": 1}
+    assert selection.tolist() == [1, 3]
+    assert copy.scaleMode == rel.ScaleModePercentile
+    assert copy.fieldNames == rel.fieldNames and copy.nominalValues == rel.nominalValues
+    np.testing.assert_array_equal(copy.dataMatrix(), rel.dataMatrix())
+    np.testing.assert_array_equal(copy.scaledMatrix(), scaled)
+    assert copy.sourceHeader == rel.sourceHeader
+
+
+def test_project_file_reloads_changed_source(tmp_path, arffFile):
+    rel = RelationFactory.loadFromFile(arffFile)
+    projectFile = str(tmp_path / "test.wvp")
+    ProjectFile.save(projectFile, rel, arffFile, {}, selection=[0])
+    with open(arffFile, "a") as f:
+        f.write("5,6,plain,e,p\n")
+
+    copy, _, _, selection = ProjectFile.load(projectFile)
+    assert len(copy.dataMatrix()) == 5
+    assert len(selection) == 0
+
+
+def test_project_file_memory_mapped(tmp_path):
+    rel = randomRelation()
+    projectFile = str(tmp_path / "test.wvp")
+    ProjectFile.save(projectFile, rel, None, {})
+    limit = RelationData.memoryLimit
+    RelationData.memoryLimit = 1024
+    try:
+        copy = ProjectFile.load(projectFile)[0]
+    finally:
+        RelationData.memoryLimit = limit
+    assert isinstance(copy.dataMatrix(), np.memmap)
+    np.testing.assert_array_equal(copy.dataMatrix(), rel.dataMatrix())
@@ -0,0 +1,289 @@
+# Copyright (c) 2016 Janek Bevendorff
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from PyQt5.QtGui import QPainter, QColor, QPen, QPixmap, QPolygonF, QFont
+from PyQt5.QtCore import *
+from PyQt5.QtWidgets import *
+from vis.VisWidget import VisWidget
+from collections import OrderedDict
+import math
+
+
+class GlyphGrid(VisWidget):
+    """
+    Small multiples: one mini star glyph per dataset or class centroid, laid out in a scrollable grid.
+    The grid has no scene items, only tiles inside the exposed area are painted. Glyph images are
+    rendered on demand and kept in an LRU cache keyed by glyph and size.
+    """
+
+    # draw one glyph per dataset
+    PlotModeRecords   = 0
+    # draw one glyph per class mean
+    PlotModeCentroids = 1
+
+    def __init__(self):
+        super().__init__()
+
+        self.bgColor = QColor(255, 255, 255)
+        self.scene().setBackgroundBrush(self.bgColor)
+        self.labelFont = QFont('Decorative', 8)
+
+        self.plotMode   = self.PlotModeRecords
+        self.maxAxes    = 50
+        self.axisFields = []
+        self.activeClasses = set()
+
+        # edge length of a glyph tile and spacing between tiles in pixels
+        self.glyphSize    = 64
+        self.glyphSpacing = 4
+        # maximum number of cached glyph images
+        self.cacheSize    = 2048
+        self.__cache      = OrderedDict()
+
+        # dataset indices (or class names in centroid mode) per tile and classes, glyph values are read
+        # from the scaled matrix cached by the relation
+        self.__tiles       = []
+        self.__classes     = []
+        self.__codes       = None
+        self.__columns     = 1
+
+        self.__centroids   = {}
+
+        self.setDragMode(QGraphicsView.NoDrag)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.plotPaletteChanged.connect(self.clearCache)
+
+    def setRelation(self, rel: "data.Relation"):
+        if self.selection is None:
+            from data import Selection
+            self.setSelection(Selection())
+        super().setRelation(rel)
+        self.activeClasses = set(self.relation.activeClasses)
+
+    def setPlotMode(self, mode):
+        """
+        @param mode: L{PlotModeRecords} or L{PlotModeCentroids}, other modes are drawn as records
+        """
+        if mode != self.PlotModeCentroids:
+            mode = self.PlotModeRecords
+        if mode != self.plotMode:
+            self.plotMode = mode
+            self.updateWidget()
+
+    def setMaxAxes(self, num):
+        self.maxAxes = num
+        self.updateWidget()
+
+    def axisFieldIndices(self):
+        """
+        @return: sorted list of attribute indices to be shown as glyph axes
+        """
+        numDims = len(self.relation.fieldNames) - 1
+        if self.maxAxes is not None and self.maxAxes < numDims:
+            return sorted(self.relation.rankAttributes()[:self.maxAxes].tolist())
+        return list(range(numDims))
+
+    def clearCache(self):
+        self.__cache.clear()
+        self.viewport().update()
+
+    def updateClassItems(self, cls):
+        for key in [k for k in self.__cache if self.__glyphClass(k[0]) == cls]:
+            del self.__cache[key]
+        self.viewport().update()
+
+    def updateWidget(self):
+        if self.relation is None:
+            return
+
+        import numpy as np
+        self.selection.resize(len(self.relation.dataMatrix()))
+        self.__cache.clear()
+        self.axisFields = self.axisFieldIndices()
+
+        classNames, codes = self.relation.classCodes()
+        if self.plotMode == self.PlotModeCentroids:
+            stats = self.relation.classStatistics(())
+            self.__classes = [c for c in sorted(stats) if c in self.activeClasses]
+            self.__centroids = {c: self.relation.scaleValues(stats[c].mean)[self.axisFields] for c in self.__classes}
+            self.__tiles = list(self.__classes)
+            self.__codes = None
+        else:
+            activeCodes = [i for i, c in enumerate(classNames) if c in self.activeClasses]
+            self.__classes = classNames
+            self.__codes = codes
+            self.__tiles = np.flatnonzero(np.isin(codes, activeCodes))
+
+        self.updateGridGeometry()
+
+    def filterClasses(self, classes):
+        self.activeClasses = set(classes)
+        self.updateWidget()
+
+    def updateGridGeometry(self):
+        tile = self.glyphSize + self.glyphSpacing
+        width = max(1, self.viewport().width())
+        self.__columns = max(1, width // tile)
+        rows = math.ceil(len(self.__tiles) / self.__columns)
+        self.setSceneRect(QRectF(0, 0, self.__columns * tile, rows * tile))
+        self.viewport().update()
+
+    def tileRect(self, position):
+        tile = self.glyphSize + self.glyphSpacing
+        row, col = divmod(position, self.__columns)
+        return QRectF(col * tile + self.glyphSpacing / 2, row * tile + self.glyphSpacing / 2,
+                      self.glyphSize, self.glyphSize)
+
+    def tileAt(self, scenePos):
+        """
+        @return: grid position of the tile at the given scene position or -1
+        """
+        tile = self.glyphSize + self.glyphSpacing
+        col = int(scenePos.x() // tile)
+        row = int(scenePos.y() // tile)
+        position = row * self.__columns + col
+        if 0 <= col < self.__columns and 0 <= row and position < len(self.__tiles):
+            return position
+        return -1
+
+    def __glyphClass(self, glyph):
+        if self.plotMode == self.PlotModeCentroids:
+            return glyph
+        return self.__classes[self.__codes[glyph]]
+
+    def __glyphImage(self, glyph):
+        key = (glyph, self.glyphSize)
+        if key in self.__cache:
+            self.__cache.move_to_end(key)
+            return self.__cache[key]
+
+        if self.plotMode == self.PlotModeCentroids:
+            values = self.__centroids[glyph]
+        else:
+            values = self.relation.scaledMatrix()[glyph, self.axisFields]
+        cls = self.__glyphClass(glyph)
+
+        size = self.glyphSize
+        radius = size / 2 - 2
+        center = QPointF(size / 2, size / 2)
+        numDims = len(values)
+        points = []
+        for i, v in enumerate(values):
+            # missing values are left out of the glyph
+            if v == v:
+                angle = 2 * math.pi * i / numDims - math.pi / 2
+                points.append(center + QPointF(math.cos(angle), math.sin(angle)) * radius * min(max(v, 0.), 1.))
+
+        img = QPixmap(size, size)
+        img.fill(Qt.transparent)
+        painter = QPainter(img)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(QColor(200, 200, 200)))
+        for i in range(numDims):
+            angle = 2 * math.pi * i / numDims - math.pi / 2
+            painter.drawLine(center, center + QPointF(math.cos(angle), math.sin(angle)) * radius)
+        painter.setBrush(self.styles.brush(cls, 80))
+        painter.setPen(self.styles.pen(cls, True))
+        painter.drawPolygon(QPolygonF(points))
+        painter.end()
+
+        self.__cache[key] = img
+        while len(self.__cache) > self.cacheSize:
+            self.__cache.popitem(last=False)
+        return img
+
+    def drawForeground(self, painter, rect):
+        if not len(self.__tiles):
+            return
+
+        # only draw the tiles intersecting the exposed rect
+        tile = self.glyphSize + self.glyphSpacing
+        firstRow = max(0, int(rect.top() // tile))
+        lastRow = int(rect.bottom() // tile)
+        firstCol = max(0, int(rect.left() // tile))
+        lastCol = min(self.__columns - 1, int(rect.right() // tile))
+
+        mask = self.selection.mask
+        highlightPen = QPen(QColor(0, 0, 0))
+        highlightPen.setWidthF(2)
+        for row in range(firstRow, lastRow + 1):
+            for col in range(firstCol, lastCol + 1):
+                position = row * self.__columns + col
+                if position >= len(self.__tiles):
+                    return
+                glyph = self.__tiles[position]
+                r = self.tileRect(position)
+                painter.drawPixmap(r.topLeft(), self.__glyphImage(glyph))
+
+                if self.plotMode == self.PlotModeCentroids:
+                    painter.setPen(QPen(QColor(0, 0, 0)))
+                    painter.setFont(self.labelFont)
+                    painter.drawText(r, Qt.AlignBottom | Qt.AlignHCenter, glyph)
+                elif glyph < len(mask) and mask[glyph]:
+                    painter.setPen(highlightPen)
+                    painter.setBrush(Qt.NoBrush)
+                    painter.drawRect(r)
+
+    def updateSelectedItems(self, changedIndices):
+        if self.plotMode == self.PlotModeCentroids or self.__codes is None:
+            return
+        if len(self.selection.mask) != len(self.__codes):
+            self.viewport().update()
+            return
+
+        import numpy as np
+        # repaint only visible tiles whose selection state has changed
+        positions = np.flatnonzero(np.isin(self.__tiles, changedIndices))
+        visible = self.mapToScene(self.viewport().rect()).boundingRect()
+        for p in positions.tolist():
+            r = self.tileRect(p)
+            if r.intersects(visible):
+                self.updateScene([r.adjusted(-2, -2, 2, 2)])
+
+    def mousePressEvent(self, event):
+        position = self.tileAt(self.mapToScene(event.pos()))
+        if self.plotMode == self.PlotModeCentroids or self.__codes is None:
+            return super().mousePressEvent(event)
+
+        modifiers = event.modifiers()
+        if position < 0:
+            if modifiers == Qt.NoModifier:
+                self.selection.clear()
+            return
+
+        record = [int(self.__tiles[position])]
+        if modifiers == Qt.ShiftModifier:
+            self.selection.select(record, self.selection.SelectAdd)
+        elif modifiers == Qt.ControlModifier:
+            self.selection.select(record, self.selection.SelectRemove)
+        else:
+            self.selection.select(record)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.relation is not None:
+            self.updateGridGeometry()
+
+    def sizeHint(self):
+        return QSize(600, 1000)
+
+    def minimumSizeHint(self):
+        return QSize(200, 200)
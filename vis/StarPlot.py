@@ -18,11 +18,13 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-from PyQt5.QtGui import QPainter, QColor, QTransform, QFont, QPen, QCursor, QVector2D, QFontMetrics
+from PyQt5.QtGui import QPainter, QColor, QTransform, QFont, QPen, QCursor, QVector2D, QFontMetrics, QPainterPath, \
+    QPolygonF, QStaticText
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 from vis.VisWidget import VisWidget
-from data import Relation
+from threading import Event
+import html
 import math
 
 
@@ -35,6 +37,18 @@ class StarPlot(VisWidget):
     axisChanged       = pyqtSignal()
     selectionChanged  = pyqtSignal()
 
+    # draw one star per dataset
+    PlotModeRecords   = 0
+    # draw only the mean star of each class with a quantile band
+    PlotModeCentroids = 1
+    # draw one star per cluster of similar datasets
+    PlotModeClusters  = 2
+
+    # connect the neighbors of a missing value directly
+    MissingValuesSkip = 0
+    # leave a gap at missing values
+    MissingValuesGap  = 1
+
     def __init__(self):
         super().__init__()
 
@@ -42,6 +56,7 @@ class StarPlot(VisWidget):
         self.scene().setBackgroundBrush(self.__bgColor)
 
         self.labelFont = QFont('Decorative', 8)
+        self.maxLabelWidth = 200
 
         self.class1Color = Qt.red
         self.class2Color = Qt.blue
@@ -51,7 +66,43 @@ class StarPlot(VisWidget):
         self.axes       = []
         self.axisAngles = []
         self.axisLabels = []
+        self.axisFields = []
         self.lineGroups = []
+        self.centroidItems = []
+        # all points, lines and centroids by class name
+        self.classItems = {}
+
+        # indices of the attributes to show as axes (None for all) and maximum number of axes, if more
+        # attributes are available, only the highest ranked ones will be added to the scene
+        self.activeAxes = None
+        self.maxAxes    = 50
+
+        self.plotMode = self.PlotModeRecords
+        self.missingValueMode = self.MissingValuesSkip
+        # per-class histograms along the axes, bin counts are cached by the relation
+        self.showHistograms  = False
+        self.histogramBins   = 20
+        self.histogramHeight = 24
+        # lower and upper quantile of the band drawn around class centroids
+        self.centroidBand = (.25, .75)
+        # maximum number of clusters per class and line width of the largest cluster
+        self.clustersPerClass    = 10
+        self.clusterMaxLineWidth = 8
+        self.__clusterThread     = None
+        self.__runningThreads    = set()
+        # index of the line group representing each dataset, -1 for datasets without a group
+        self.__recordGroups      = None
+
+        # scaled values of the cluster stars along the active axes (dataset stars are read from the relation's
+        # scaled matrix) and spatial index of their projected vertices, which is rebuilt when the axis
+        # geometry or the visible classes change
+        self.__starValues        = None
+        self.__datasetStars      = False
+        self.__vertexIndex       = None
+        self.__vertexGroups      = None
+        self.__vertexGeometry    = None
+        # maximum distance in pixels between mouse cursor and a vertex for showing its dataset
+        self.hoverRadius         = 8
 
         self.highlightedItems = set()
         self.highlightedRings = set()
@@ -64,6 +115,7 @@ class StarPlot(VisWidget):
 
         self.selectionUpdateDelay = 200
         self.__selectionUpdateTimer = QTimer(self)
+        self.__selectionUpdateTimer.setSingleShot(True)
         self.__selectionUpdateTimer.timeout.connect(self.selectionChanged.emit)
 
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
@@ -74,7 +126,14 @@ class StarPlot(VisWidget):
         self.rubberBandChanged.connect(self.selectData)
         self.setCacheMode(QGraphicsView.CacheBackground)
 
-        self.colorDialog = QColorDialog()
+        self.__colorDialog = None
+
+    @property
+    def colorDialog(self):
+        # created on first use to speed up start-up
+        if self.__colorDialog is None:
+            self.__colorDialog = QColorDialog()
+        return self.__colorDialog
 
     @property
     def bgColor(self):
@@ -86,14 +145,82 @@ class StarPlot(VisWidget):
         self.scene().setBackgroundBrush(self.__bgColor)
 
     def getClassColor(self, cls):
-        if self.plotPalette is None or cls not in self.plotPalette:
-            return QColor()
+        return self.styles.color(cls)
 
-        return self.plotPalette[cls]
+    def updateClassItems(self, cls):
+        for i in self.classItems.get(cls, []):
+            i.update()
+        if self.showHistograms:
+            for a in self.axes:
+                a.update()
 
-    def setRelation(self, rel: Relation):
+    def setRelation(self, rel: "data.Relation"):
+        if self.selection is None:
+            from data import Selection
+            self.setSelection(Selection())
         super().setRelation(rel)
         self.activeClasses = self.relation.activeClasses
+        self.activeAxes = None
+
+    def setActiveAxes(self, fieldIndices):
+        """
+        Select which attributes are shown as axes. Axes of inactive attributes are not added to the scene.
+
+        @param fieldIndices: attribute indices or None to use the L{maxAxes} highest ranked attributes
+        """
+        self.activeAxes = None if fieldIndices is None else list(fieldIndices)
+        self.updateWidget()
+
+    def setMaxAxes(self, num):
+        """
+        Set maximum number of automatically selected axes.
+
+        @param num: maximum number of axes or None for no limit
+        """
+        self.maxAxes = num
+        self.updateWidget()
+
+    def axisFieldIndices(self):
+        """
+        @return: sorted list of attribute indices to be shown as axes
+        """
+        numDims = len(self.relation.fieldNames) - 1
+        if self.activeAxes is not None:
+            return sorted(set(i for i in self.activeAxes if 0 <= i < numDims))
+        if self.maxAxes is not None and self.maxAxes < numDims:
+            return sorted(self.relation.rankAttributes()[:self.maxAxes].tolist())
+        return list(range(numDims))
+
+    def setPlotMode(self, mode):
+        """
+        Set whether to draw individual datasets, class centroids or clusters of datasets.
+
+        @param mode: L{PlotModeRecords}, L{PlotModeCentroids} or L{PlotModeClusters}
+        """
+        if mode != self.plotMode and mode in (self.PlotModeRecords, self.PlotModeCentroids, self.PlotModeClusters):
+            self.plotMode = mode
+            self.updateWidget()
+
+    def setMissingValueMode(self, mode):
+        """
+        Set how stars are drawn around missing values.
+
+        @param mode: L{MissingValuesSkip} or L{MissingValuesGap}
+        """
+        if mode != self.missingValueMode and mode in (self.MissingValuesSkip, self.MissingValuesGap):
+            self.missingValueMode = mode
+            self.updateWidget()
+
+    def setShowHistograms(self, show):
+        """
+        Show or hide per-class histograms along the axes. Toggling only repaints the axes.
+
+        @param show: True to show histograms
+        """
+        if show != self.showHistograms:
+            self.showHistograms = show
+            for a in self.axes:
+                a.updateHistogramGeometry()
 
     def updateWidget(self):
         self.setUpdatesEnabled(False)
@@ -103,19 +230,34 @@ class StarPlot(VisWidget):
 
         # save axis rotations, but only if we don't have a new dataset with a different number of axes
         self.axisAngles.clear()
-        if len(self.axes) == len(self.relation.fieldNames) - 1:
+        axisFields = self.axisFieldIndices()
+        if len(self.axes) == len(axisFields):
             for a in self.axes:
                 self.axisAngles.append(a.rotation())
+        self.axisFields = axisFields
 
         self.lineGroups.clear()
+        self.centroidItems.clear()
+        self.classItems.clear()
         self.highlightedItems.clear()
         self.highlightedRings.clear()
+        self.__recordGroups = None
+        self.__starValues = None
+        self.__datasetStars = False
+        self.__vertexIndex = None
+        self.selection.resize(len(self.relation.dataMatrix()))
         self.axisLabels.clear()
         self.axes.clear()
         self.scene().clear()
 
         self.addAxes()
-        self.addPoints()
+        if self.plotMode == self.PlotModeCentroids:
+            self.addCentroids()
+        elif self.plotMode == self.PlotModeClusters:
+            self.startClustering()
+        else:
+            self.addPoints()
+            self.indexLineGroups()
 
         if self.axisAngles:
             self.reparentLines()
@@ -123,11 +265,12 @@ class StarPlot(VisWidget):
         self.setUpdatesEnabled(False)
 
     def addAxes(self):
-        numDims = len(self.relation.fieldNames) - 1
+        numDims = len(self.axisFields)
         angle = 360 / numDims
         axisDomains = self.relation.axisDomains
-        for i in range(numDims):
+        for i, field in enumerate(self.axisFields):
             axis = PlotAxis(self)
+            axis.field = field
             self.scene().addItem(axis)
             if self.axisAngles and i < len(self.axisAngles):
                 axis.setRotation(self.axisAngles[i])
@@ -135,33 +278,344 @@ class StarPlot(VisWidget):
                 axis.setRotation(angle * i)
             self.axes.append(axis)
 
-            domain = axisDomains[i]
-            text = PlotAxisLabel("{}\n[{:.2f},{:.2f}]".format(self.relation.fieldNames[i], domain[0], domain[1]))
-            text.setFont(self.labelFont)
+            if field in self.relation.nominalValues:
+                values = self.relation.nominalValues[field]
+                axis.categoryTicks = self.relation.scaleColumnValues(field, range(len(values))).tolist()
+                valueText = QFontMetrics(self.labelFont).elidedText("{" + ", ".join(values) + "}", Qt.ElideRight,
+                                                                    self.maxLabelWidth)
+                text = PlotAxisLabel("{}\n{}".format(self.relation.fieldNames[field], valueText), self.labelFont)
+            else:
+                domain = axisDomains[field]
+                text = PlotAxisLabel("{}\n[{:.2f},{:.2f}]".format(self.relation.fieldNames[field], domain[0], domain[1]),
+                                     self.labelFont)
             self.axisLabels.append(text)
             text.setParentItem(axis)
+            axis.label = text
+            text.updateLayout()
+
+    def addPoints(self, blockSize=4096):
+        # read blocks of rows from the scaled matrix cached by the relation, so linked views don't keep
+        # their own copies of the active axes
+        import numpy as np
+        classNames, codes = self.relation.classCodes()
+        scaled = self.relation.scaledMatrix()
+        self.__datasetStars = True
+
+        allAxes = list(range(len(self.axisFields)))
+        for start in range(0, len(scaled), blockSize):
+            block = scaled[start:start + blockSize][:, self.axisFields]
+            # axes with values of each dataset, found in one vectorized pass, complete datasets share one list
+            missing = np.isnan(block)
+            starAxes = [allAxes] * len(block)
+            for i in np.flatnonzero(missing.any(axis=1)).tolist():
+                starAxes[i] = np.flatnonzero(~missing[i]).tolist()
+
+            for i, (vals, code) in enumerate(zip(block.tolist(), codes[start:start + blockSize].tolist())):
+                self.addStar(vals, classNames[code], [start + i], axes=starAxes[i])
+
+    def __starRows(self, groups):
+        """
+        @param groups: NumPy array of line group indices
+        @return: scaled values of these stars along the active axes, None if no stars are shown
+        """
+        if self.__starValues is not None:
+            return self.__starValues[groups]
+        if self.__datasetStars and len(self.lineGroups) == len(self.relation.dataMatrix()):
+            import numpy as np
+            return self.relation.scaledMatrix()[np.ix_(groups, self.axisFields)]
+        return None
+
+    def addStar(self, vals, cls, recordIndices, lineWidth=1, axes=None):
+        """
+        Add points and connecting lines for one star to the scene.
 
-    def addPoints(self):
-        numDims = len(self.relation.fieldNames) - 1
-        datasets = self.relation.getScaledDatasets()
-        for ds in datasets:
-            points = []
-            lines = []
-            for i in range(numDims):
-                p = PlotPoint(self, ds[i], ds[-1])
-                p.setParentItem(self.axes[i])
-                points.append(p)
-
-                if 0 < i:
-                    lines.append(PlotLine(self, points[i - 1], p))
-                if i == numDims - 1:
-                    lines.append(PlotLine(self, p, points[0]))
-
-            group = self.scene().createItemGroup(lines)
-            group.dataClassLabel = points[0].cls
-            self.lineGroups.append(group)
+        @param vals: scaled value per active axis
+        @param cls: class name
+        @param recordIndices: indices of the datasets represented by this star
+        @param lineWidth: width of the connecting lines
+        @param axes: indices of the axes with (non-missing) values, None for all
+        """
+        numDims = len(self.axes)
+        if axes is None:
+            axes = range(numDims)
+        points = []
+        lines = []
+        for i, axis in enumerate(axes):
+            p = PlotPoint(self, vals[axis], cls)
+            p.setParentItem(self.axes[axis])
+            points.append(p)
+
+            if 0 < i:
+                lines.append(PlotLine(self, points[i - 1], p, lineWidth))
+            if i == len(axes) - 1:
+                lines.append(PlotLine(self, p, points[0], lineWidth))
+
+        if len(points) < numDims and self.missingValueMode == self.MissingValuesGap:
+            # lines between points of non-neighboring axes span a missing value
+            for i, line in enumerate(lines):
+                line.gap = (axes[(i + 1) % len(axes)] - axes[i]) % numDims != 1
+
+        self.classItems.setdefault(cls, []).extend(points + lines)
+        group = self.scene().createItemGroup(lines)
+        group.dataClassLabel = cls
+        group.recordIndices = recordIndices
+        self.lineGroups.append(group)
+        return group
+
+    def startClustering(self):
+        """
+        Cluster the datasets in a worker thread. The clusters are added to the scene once they are ready.
+        """
+        thread = ClusterThread(self.relation.clusterTask(self.clustersPerClass))
+        thread.clustersReady.connect(self.addClusters)
+        thread.finished.connect(self._clusterThreadFinished)
+        self.__runningThreads.add(thread)
+        self.__clusterThread = thread
+        thread.start()
+
+    def stopWorkers(self):
+        """
+        Cancel running clustering threads and wait for them to finish.
+        """
+        for thread in list(self.__runningThreads):
+            thread.cancel()
+            thread.wait()
+        self.__runningThreads.clear()
+        self.__clusterThread = None
+
+    @pyqtSlot()
+    def _clusterThreadFinished(self):
+        self.__runningThreads.discard(self.sender())
+
+    @pyqtSlot(object)
+    def addClusters(self, clusters):
+        # ignore results of outdated clustering runs
+        if self.sender() is not self.__clusterThread or self.plotMode != self.PlotModeClusters:
+            return
+
+        import numpy as np
+        maxSize = max([c.size for c in clusters] + [1])
+        self.__starValues = np.array([c.center[self.axisFields] for c in clusters]).reshape(len(clusters), -1)
+        self.__vertexIndex = None
+        for c in clusters:
+            lineWidth = 1 + (self.clusterMaxLineWidth - 1) * c.size / maxSize
+            self.addStar(c.center[self.axisFields], c.cls, c.members, lineWidth)
+
+        self.indexLineGroups()
+        self.filterClasses(self.activeClasses)
+        self.reparentLines()
+        self.axisChanged.emit()
+
+    def selectedRecords(self):
+        """
+        @return: sorted NumPy array with the indices of all selected datasets
+        """
+        return self.selection.indices()
+
+    def selectRecords(self, indices):
+        """
+        Select the given datasets in all views sharing this view's selection.
+        Stars are highlighted if they represent at least one selected dataset.
+
+        @param indices: dataset indices
+        """
+        self.selection.select(indices)
+
+    def indexLineGroups(self):
+        """
+        Map datasets to the line groups representing them and highlight the groups of all selected datasets.
+        Called once all stars have been added to the scene.
+        """
+        import numpy as np
+        self.__recordGroups = np.full(self.selection.size, -1, dtype=np.intp)
+        for i, g in enumerate(self.lineGroups):
+            self.__recordGroups[g.recordIndices] = i
+        self.updateSelectedItems(self.selection.indices())
+
+    def updateSelectedItems(self, changedIndices):
+        if self.__recordGroups is None:
+            return
+
+        import numpy as np
+        mask = self.selection.mask
+        if len(mask) != len(self.__recordGroups):
+            # the selection was resized for a new relation, the items are replaced by the next update
+            for line in self.highlightedItems:
+                line.highlighted = False
+            self.highlightedItems.clear()
+            self.highlightedRings.clear()
+            self.__selectionUpdateTimer.start(self.selectionUpdateDelay)
+            return
+        groups = self.__recordGroups[changedIndices]
+        for i in np.unique(groups[groups >= 0]).tolist():
+            group = self.lineGroups[i]
+            highlighted = bool(mask[group.recordIndices].any())
+            for line in group.childItems():
+                line.highlighted = highlighted
+                if highlighted:
+                    self.highlightedItems.add(line)
+                else:
+                    self.highlightedItems.discard(line)
+            if highlighted:
+                self.highlightedRings.add(group)
+            else:
+                self.highlightedRings.discard(group)
+
+        self.__selectionUpdateTimer.start(self.selectionUpdateDelay)
+
+    def vertexIndex(self):
+        """
+        Spatial index over the scene positions of all visible star vertices. The index is only rebuilt
+        if axis rotations or lengths, the stars or the visible classes have changed.
+
+        @return: tuple of L{datacore.PointGridIndex} and array with the line group index of each vertex
+                 or (None, None) if no stars are shown
+        """
+        if not self.axes or (self.__starValues is not None and len(self.__starValues) != len(self.lineGroups)):
+            return None, None
+
+        geometry = tuple((a.rotation(), a.boundingRect().width()) for a in self.axes)
+        if self.__vertexIndex is None or geometry != self.__vertexGeometry:
+            import numpy as np
+            from datacore import PointGridIndex
+            angles = np.radians([g[0] for g in geometry])
+            lengths = np.array([g[1] for g in geometry])
+            visible = np.flatnonzero([g.dataClassLabel in self.activeClasses for g in self.lineGroups])
+            values = self.__starRows(visible)
+            if values is None:
+                return None, None
+            values = values * lengths
+            points = np.stack((values * np.cos(angles), values * np.sin(angles)), axis=-1)
+            points = points.reshape(-1, 2)
+            groups = np.repeat(visible, len(self.axes))
+            present = ~np.isnan(points[:, 0])
+            self.__vertexIndex = PointGridIndex(points[present], cellSize=self.hoverRadius)
+            self.__vertexGroups = groups[present]
+            self.__vertexGeometry = geometry
+        return self.__vertexIndex, self.__vertexGroups
+
+    def starAt(self, scenePos, maxDistance=None):
+        """
+        Find the star with the vertex closest to a scene position.
+
+        @param scenePos: L{QPointF} in scene coordinates
+        @param maxDistance: maximum distance, defaults to L{hoverRadius}
+        @return: line group or None
+        """
+        index, groups = self.vertexIndex()
+        if index is None:
+            return None
+        vertex, _ = index.nearest(scenePos.x(), scenePos.y(), maxDistance or self.hoverRadius)
+        return self.lineGroups[groups[vertex]] if vertex >= 0 else None
+
+    def starToolTip(self, group):
+        """
+        @return: text with class and attribute values of the dataset (or the size of the cluster)
+                 represented by a star
+        """
+        lines = [group.dataClassLabel]
+        if len(group.recordIndices) != 1:
+            lines.append(self.tr("Cluster of {} datasets").format(len(group.recordIndices)))
+            return "\n".join(lines)
+
+        row = self.relation.dataMatrix()[group.recordIndices[0]]
+        for field in self.axisFields:
+            value = row[field]
+            if value != value:
+                value = "?"
+            elif field in self.relation.nominalValues:
+                value = self.relation.nominalValues[field][int(value)]
+            else:
+                value = "{:g}".format(value)
+            lines.append("{}: {}".format(self.relation.fieldNames[field], value))
+        return "\n".join(lines)
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        if event.buttons() != Qt.NoButton:
+            return
+
+        group = self.starAt(self.mapToScene(event.pos()))
+        if group is None:
+            QToolTip.hideText()
+        else:
+            QToolTip.showText(event.globalPos(), self.starToolTip(group), self)
+
+    def viewState(self):
+        """
+        @return: JSON-serializable dict describing the current view, which can be restored
+                 with L{restoreViewState}
+        """
+        return {
+            "plotMode":         self.plotMode,
+            "missingValueMode": self.missingValueMode,
+            "showHistograms":   self.showHistograms,
+            "activeAxes":       self.activeAxes,
+            "maxAxes":          self.maxAxes,
+            "axisFields":       list(self.axisFields),
+            "axisAngles":       [a.rotation() for a in self.axes],
+            "activeClasses":    sorted(self.activeClasses),
+            "palette":          {c: QColor(v).name(QColor.HexArgb) for c, v in (self.plotPalette or {}).items()},
+            "bgColor":          QColor(self.bgColor).name(QColor.HexArgb),
+        }
+
+    def restoreViewState(self, state):
+        """
+        Restore a view state saved with L{viewState}. The relation has to be set first.
+
+        @param state: view state dict
+        """
+        self.plotMode         = state.get("plotMode", self.PlotModeRecords)
+        self.missingValueMode = state.get("missingValueMode", self.missingValueMode)
+        self.showHistograms   = state.get("showHistograms", self.showHistograms)
+        self.activeAxes       = state.get("activeAxes")
+        self.maxAxes          = state.get("maxAxes", self.maxAxes)
+        self.activeClasses    = set(state.get("activeClasses", self.relation.allClasses))
+        if "bgColor" in state:
+            self.bgColor = QColor(state["bgColor"])
+        self.styles.setColors(self.viewStatePalette(state))
+
+        self.updateWidget()
+        angles = state.get("axisAngles", [])
+        if self.axisFields == state.get("axisFields") and len(angles) == len(self.axes):
+            for a, angle in zip(self.axes, angles):
+                a.setRotation(angle)
+            self.axisAngles = list(angles)
+            self.reparentLines()
+        self.filterClasses(self.activeClasses)
+        self.axisChanged.emit()
+
+    @staticmethod
+    def viewStatePalette(state):
+        """
+        @return: class palette dict with L{QColor} values stored in a view state
+        """
+        return {c: QColor(v) for c, v in state.get("palette", {}).items()}
+
+    def addCentroids(self):
+        lower, upper = self.centroidBand
+        stats = self.relation.classStatistics((lower, .5, upper))
+        fields = self.axisFields
+        import numpy as np
+
+        # attributes without any values in a class are drawn at the plot center
+        def scale(values):
+            return np.nan_to_num(self.relation.scaleValues(values)[fields])
+
+        for cls in sorted(stats):
+            s = stats[cls]
+            item = PlotClassCentroid(self, cls, scale(s.mean), scale(s.quantile(lower)), scale(s.quantile(upper)))
+            item.setVisible(cls in self.activeClasses)
+            self.scene().addItem(item)
+            self.centroidItems.append(item)
+            self.classItems.setdefault(cls, []).append(item)
 
     def reparentLines(self):
+        numAxes = len(self.axes)
+        axisOrder = sorted(self.axes, key=lambda a: a.rotation())
+        nextAxis = {a: axisOrder[(i + 1) % numAxes] for i, a in enumerate(axisOrder)}
+        gaps = self.missingValueMode == self.MissingValuesGap
+
         for lg in self.lineGroups:
             lines = lg.childItems()
             lines = list(sorted(lines, key=lambda x: x.p1.parentItem().rotation()))
@@ -169,6 +623,12 @@ class StarPlot(VisWidget):
             numDims = len(lines)
             for i, l in enumerate(lines):
                 l.p2 = lines[i + 1 if i + 1 < numDims else 0].p1
+            if gaps and numDims < numAxes:
+                for l in lines:
+                    l.gap = nextAxis[l.p1.parentItem()] is not l.p2.parentItem()
+
+        for c in self.centroidItems:
+            c.updateGeometry()
 
     def filterClasses(self, classes):
         """
@@ -179,10 +639,14 @@ class StarPlot(VisWidget):
         """
         items = self.scene().items()
         for i in items:
-            if type(i) == PlotLine or type(i) == PlotPoint:
+            if type(i) == PlotLine or type(i) == PlotPoint or type(i) == PlotClassCentroid:
                 i.setVisible(i.cls in classes)
 
         self.activeClasses = classes
+        self.__vertexIndex = None
+        if self.showHistograms:
+            for a in self.axes:
+                a.update()
 
     def mouseDoubleClickEvent(self, event):
         self.colorDialog.setCurrentColor(self.bgColor)
@@ -207,33 +671,23 @@ class StarPlot(VisWidget):
         if fromScenePoint == toScenePoint:
             return
 
-        if QApplication.keyboardModifiers() != Qt.ShiftModifier and QApplication.keyboardModifiers() != Qt.ControlModifier:
-            # unselect all currently selected items
-            for h in self.highlightedItems:
-                h.highlighted = False
-            self.highlightedItems.clear()
-            self.highlightedRings.clear()
+        modifiers = QApplication.keyboardModifiers()
+        if modifiers == Qt.ShiftModifier:
+            mode = self.selection.SelectAdd
+        elif modifiers == Qt.ControlModifier:
+            mode = self.selection.SelectRemove
+        else:
+            mode = self.selection.SelectReplace
 
-        sel = self.items(rubberBandRect)
-        for s in sel:
-            if type(s) == PlotLine:
-                parent = s.parentItem()
-                siblings = parent.childItems()
-
-                if QApplication.keyboardModifiers() == Qt.ControlModifier:
-                    for sib in siblings:
-                        if sib in self.highlightedItems:
-                            sib.highlighted = False
-                            self.highlightedItems.remove(sib)
-                    if parent in self.highlightedRings:
-                        self.highlightedRings.remove(parent)
-                else:
-                    for sib in siblings:
-                        sib.highlighted = True
-                        self.highlightedItems.add(sib)
-                    self.highlightedRings.add(parent)
+        indices = []
+        rings = set()
+        for s in self.items(rubberBandRect):
+            if type(s) == PlotLine and not s.gap and s.parentItem() not in rings:
+                rings.add(s.parentItem())
+                indices.extend(s.parentItem().recordIndices)
 
-        self.__selectionUpdateTimer.start(self.selectionUpdateDelay)
+        # only changed datasets are updated by updateSelectedItems() in this and all linked views
+        self.selection.select(indices, mode)
 
     def sizeHint(self):
         return QSize(1000, 1000)
@@ -249,8 +703,14 @@ class PlotAxis(QGraphicsObject):
         super().__init__()
         self.view = view
 
-        self.p1 = QPoint(0, 0)
-        self.p2 = QPoint(0, 0)
+        self.p1 = QPointF(0, 0)
+        self.p2 = QPointF(0, 0)
+        self.label = None
+        # attribute index shown by this axis
+        self.field = None
+        # scaled positions of the values of a nominal attribute
+        self.categoryTicks = []
+        self.tickLen = 3
 
         self.paddingHoriz = 30
         self.paddingVert  = 60 + QFontMetrics(self.view.labelFont).height() * 2
@@ -394,21 +854,70 @@ class PlotAxis(QGraphicsObject):
         self.__canvasW = self.view.rect().size().width() - self.paddingHoriz
         self.__canvasH = self.view.rect().size().height() - self.paddingVert
         self.__canvasMaxDim = min(self.__canvasW, self.__canvasH)
+        self.p2 = QPointF(self.__canvasMaxDim / 2, 0)
         lw = max(self.axesWidth, self.axesWidthHighl) / 2 + 4
         self.__boundingRect = QRectF(QPoint(0 - lw, 0 - lw), QPoint(self.__canvasMaxDim / 2 + lw, lw))
+        if self.view.showHistograms:
+            self.__boundingRect.setTop(-lw - self.view.histogramHeight)
         self.itemChange(self.ItemAxisLenHasChanged, None)
         self.view.setUpdatesEnabled(True)
 
+    def updateHistogramGeometry(self):
+        """
+        Grow or shrink the bounding rect for the histogram without changing the axis length.
+        """
+        if self.__boundingRect is None:
+            return
+        self.prepareGeometryChange()
+        lw = -self.__boundingRect.bottom()
+        self.__boundingRect.setTop(lw - self.view.histogramHeight if self.view.showHistograms else lw)
+        self.update()
+
     def itemChange(self, change, variant):
+        if self.label is not None and \
+                (change == self.ItemAxisLenHasChanged or change == QGraphicsItem.ItemRotationHasChanged):
+            self.label.updateLayout()
+
         if change == self.ItemAxisLenHasChanged or \
-                (change == QGraphicsItem.ItemRotationHasChanged and self.view.relation.numDatasets < 200):
+                (change == QGraphicsItem.ItemRotationHasChanged and
+                 (self.view.relation.numDatasets < 200 or self.view.plotMode != StarPlot.PlotModeRecords)):
             self.view.axisChanged.emit()
         return super().itemChange(change, variant)
 
     def paint(self, qp: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget=None):
+        if self.view.showHistograms and self.field is not None:
+            self.paintHistogram(qp)
         qp.setPen(self.axesPen)
-        self.p2 = QPoint(min(self.__canvasW, self.__canvasH) / 2, 0)
         qp.drawLine(self.p1, self.p2)
+        axisLen = self.boundingRect().width()
+        for t in self.categoryTicks:
+            qp.drawLine(QPointF(t * axisLen, -self.tickLen), QPointF(t * axisLen, self.tickLen))
+
+    def paintHistogram(self, qp: QPainter):
+        """
+        Paint the histograms of all active classes stacked on one side of the axis. Bars are drawn in
+        item coordinates, so rotating the axis needs neither a recount nor a new layout.
+        """
+        import numpy as np
+        classNames = self.view.relation.classCodes()[0]
+        counts = self.view.relation.histograms(self.view.histogramBins)[:, self.field]
+        active = [i for i, c in enumerate(classNames) if c in self.view.activeClasses]
+        if not active:
+            return
+        stacked = np.cumsum(counts[active], axis=0)
+        maxCount = stacked[-1].max()
+        if maxCount == 0:
+            return
+
+        scale = self.view.histogramHeight / maxCount
+        binWidth = self.boundingRect().width() / counts.shape[1]
+        qp.setPen(Qt.NoPen)
+        bottom = np.zeros(counts.shape[1], dtype=stacked.dtype)
+        for i, top in zip(active, stacked):
+            qp.setBrush(self.view.styles.brush(classNames[i], 120))
+            for b in np.flatnonzero(top > bottom).tolist():
+                qp.drawRect(QRectF(b * binWidth, -top[b] * scale, binWidth, (top[b] - bottom[b]) * scale))
+            bottom = top
 
     def boundingRect(self):
         if self.__boundingRect is None:
@@ -416,29 +925,51 @@ class PlotAxis(QGraphicsObject):
         return self.__boundingRect
 
 
-class PlotAxisLabel(QGraphicsTextItem):
-    def __init__(self, text):
-        super().__init__(text)
-        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges, True)
+class PlotAxisLabel(QGraphicsItem):
+    """
+    Axis label drawn from pre-laid-out static text. The label position is only recalculated when
+    the geometry of its parent axis changes, not on every paint.
+    """
 
-    def paint(self, qp: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget=None):
+    def __init__(self, text, font):
+        super().__init__()
+        self.font = font
+        self.margin = 4
+
+        self.__staticText = QStaticText(html.escape(text).replace("\n", "<br>"))
+        self.__staticText.setTextFormat(Qt.RichText)
+        self.__staticText.prepare(QTransform(), font)
+        size = self.__staticText.size()
+        self.__boundingRect = QRectF(0, 0, size.width() + 2 * self.margin, size.height() + 2 * self.margin)
+
+    def updateLayout(self):
         p = self.parentItem()
+        if p is None:
+            return
+
         pRot = p.rotation()
         trans = QTransform()
-        trans.rotate(-p.rotation())
+        trans.rotate(-pRot)
 
         p2Scene = p.mapToScene(p.p2)
+        w = self.__boundingRect.width()
+        h = self.__boundingRect.height()
         if 0 <= pRot < 90:
-            trans.translate(p2Scene.x() - self.boundingRect().width(), p2Scene.y())
+            trans.translate(p2Scene.x() - w, p2Scene.y())
         elif 90 <= pRot < 180:
             trans.translate(p2Scene.x(), p2Scene.y())
         elif 180 <= pRot < 270:
-            trans.translate(p2Scene.x(), p2Scene.y() - self.boundingRect().height())
-        elif 270 <= 360:
-            trans.translate(p2Scene.x() - self.boundingRect().width(), p2Scene.y() - self.boundingRect().height())
+            trans.translate(p2Scene.x(), p2Scene.y() - h)
+        else:
+            trans.translate(p2Scene.x() - w, p2Scene.y() - h)
         self.setTransform(trans)
 
-        super().paint(qp, option, widget)
+    def paint(self, qp: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget=None):
+        qp.setFont(self.font)
+        qp.drawStaticText(QPointF(self.margin, self.margin), self.__staticText)
+
+    def boundingRect(self):
+        return self.__boundingRect
 
 
 class PlotPoint(QGraphicsItem):
@@ -451,21 +982,14 @@ class PlotPoint(QGraphicsItem):
         self.__axisLen = 0
         self.__boundingRect = None
 
-        self._pen = None
-
-        self.updateColor()
-        view.plotPaletteChanged.connect(self.updateColor)
         view.axisChanged.connect(self.updateAxisLen)
 
-    def updateColor(self):
-        self._pen = QPen(self.view.getClassColor(self.cls))
-
     def updateAxisLen(self):
         self.__axisLen = self.parentItem().boundingRect().width()
         self.__boundingRect = QRectF(QPoint(self.val * self.__axisLen - 2, -2), QPoint(self.val * self.__axisLen + 2, 2))
 
     def paint(self, qp: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget = None):
-        qp.setPen(self._pen)
+        qp.setPen(self.view.styles.pen(self.cls))
         qp.drawRect(self.boundingRect())
 
     def boundingRect(self):
@@ -475,31 +999,34 @@ class PlotPoint(QGraphicsItem):
 
 
 class PlotLine(QGraphicsLineItem):
-    def __init__(self, view, p1, p2):
+    def __init__(self, view, p1, p2, lineWidth=1):
         super().__init__()
         self.p1 = p1
         self.p2 = p2
         self.cls = p1.cls
         self.view = view
-        self.highlighted = False
-        self.lineWidth = 1
-        self.lineWidthHighl = 4
-        self._pen = None
-        self._penHighl = None
-
-        self.updateColor()
+        self.__highlighted = False
+        self.lineWidth = lineWidth
+        self.lineWidthHighl = lineWidth + 3
+        # whether the line spans a missing value and is not drawn
+        self.gap = False
+
+        # the item pen is only used for the bounding rect, actual pens come from the view's style table
+        boundsPen = QPen()
+        boundsPen.setWidthF(self.lineWidthHighl)
+        self.setPen(boundsPen)
         self.updateLine()
-        view.plotPaletteChanged.connect(self.updateColor)
         view.axisChanged.connect(self.updateLine)
 
-    def updateColor(self):
-        color = self.view.getClassColor(self.cls)
-        self._pen = QPen(color)
-        self._pen.setWidth(self.lineWidth)
-        colorHighl = QColor(color)
-        colorHighl.setAlpha(255)
-        self._penHighl = QPen(colorHighl)
-        self._penHighl.setWidth(self.lineWidthHighl)
+    @property
+    def highlighted(self):
+        return self.__highlighted
+
+    @highlighted.setter
+    def highlighted(self, highlighted):
+        if highlighted != self.__highlighted:
+            self.__highlighted = highlighted
+            self.update()
 
     def updateLine(self):
         p1 = self.p1.mapToScene(self.p1.boundingRect().center())
@@ -507,6 +1034,89 @@ class PlotLine(QGraphicsLineItem):
         self.setLine(QLineF(p1, p2))
 
     def paint(self, qp: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget = None):
-        self.setPen(self._pen if not self.highlighted else self._penHighl)
-        super().paint(qp, option, widget)
+        if self.gap:
+            return
+        if self.__highlighted:
+            qp.setPen(self.view.styles.pen(self.cls, True, self.lineWidthHighl))
+        else:
+            qp.setPen(self.view.styles.pen(self.cls, False, self.lineWidth))
+        qp.drawLine(self.line())
+
+
+class ClusterThread(QThread):
+    """
+    Worker thread for clustering the datasets of a relation.
+    """
 
+    clustersReady = pyqtSignal(object)
+
+    def __init__(self, task):
+        """
+        @param task: clustering task returned by L{datacore.RelationData.clusterTask}
+        """
+        super().__init__()
+        self.task = task
+        self.__cancelled = Event()
+
+    def cancel(self):
+        """
+        Stop clustering as soon as possible, no results are emitted afterwards.
+        """
+        self.__cancelled.set()
+
+    def run(self):
+        clusters = self.task(self.__cancelled)
+        if clusters is not None and not self.__cancelled.is_set():
+            self.clustersReady.emit(clusters)
+
+
+class PlotClassCentroid(QGraphicsItem):
+    """
+    Mean star of one class surrounded by a band between a lower and an upper quantile star.
+    """
+
+    def __init__(self, view, cls, mean, lower, upper):
+        super().__init__()
+        self.view  = view
+        self.cls   = cls
+        self.mean  = mean
+        self.lower = lower
+        self.upper = upper
+
+        self.lineWidth = 2
+        self.bandAlpha = 50
+
+        self.__meanPolygon = QPolygonF()
+        self.__bandPath    = QPainterPath()
+
+        self.updateGeometry()
+        view.axisChanged.connect(self.updateGeometry)
+
+    def __starPolygon(self, vals):
+        axes = self.view.axes
+        polygon = QPolygonF()
+        for i in sorted(range(len(axes)), key=lambda x: axes[x].rotation()):
+            polygon.append(axes[i].mapToScene(QPointF(vals[i] * axes[i].boundingRect().width(), 0)))
+        return polygon
+
+    def updateGeometry(self):
+        self.prepareGeometryChange()
+        self.__meanPolygon = self.__starPolygon(self.mean)
+        self.__bandPath = QPainterPath()
+        self.__bandPath.setFillRule(Qt.OddEvenFill)
+        self.__bandPath.addPolygon(self.__starPolygon(self.upper))
+        self.__bandPath.closeSubpath()
+        self.__bandPath.addPolygon(self.__starPolygon(self.lower))
+        self.__bandPath.closeSubpath()
+
+    def paint(self, qp: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget = None):
+        qp.setPen(Qt.NoPen)
+        qp.setBrush(self.view.styles.brush(self.cls, self.bandAlpha))
+        qp.drawPath(self.__bandPath)
+        qp.setPen(self.view.styles.pen(self.cls, True, self.lineWidth))
+        qp.setBrush(Qt.NoBrush)
+        qp.drawPolygon(self.__meanPolygon)
+
+    def boundingRect(self):
+        lw = self.lineWidth
+        return self.__bandPath.boundingRect().united(self.__meanPolygon.boundingRect()).adjusted(-lw, -lw, lw, lw)
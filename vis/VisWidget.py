@@ -20,11 +20,73 @@
 
 from PyQt5.QtCore import pyqtSignal, QRectF, QPointF
 from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene
-from PyQt5.QtGui import QPainter
-from data import Relation
+from PyQt5.QtGui import QPainter, QColor, QPen, QBrush
 from abc import abstractmethod
 
 
+class ClassStyleTable(object):
+    """
+    Pens and brushes for drawing the items of each class, shared by all items of a view.
+    Pens and brushes are created on first use and cached per class, highlight state and width.
+    """
+
+    def __init__(self):
+        self.__colors  = {}
+        self.__pens    = {}
+        self.__brushes = {}
+
+    def setColors(self, paletteDict):
+        """
+        Replace all class colors.
+
+        @param paletteDict: dict with class names as keys and L{QColor} objects as values
+        """
+        self.__colors = dict(paletteDict)
+        self.__pens.clear()
+        self.__brushes.clear()
+
+    def setColor(self, cls, color):
+        """
+        Change the color of a single class. Cached styles of other classes are kept.
+        """
+        self.__colors[cls] = QColor(color)
+        self.__pens.pop(cls, None)
+        self.__brushes.pop(cls, None)
+
+    def color(self, cls):
+        return self.__colors.get(cls, QColor())
+
+    def pen(self, cls, highlighted=False, width=1):
+        """
+        @param cls: class name
+        @param highlighted: whether to use the opaque highlight color
+        @param width: line width
+        @return: cached L{QPen}, must not be modified
+        """
+        pens = self.__pens.setdefault(cls, {})
+        key = (highlighted, width)
+        if key not in pens:
+            color = QColor(self.color(cls))
+            if highlighted:
+                color.setAlpha(255)
+            pens[key] = QPen(color)
+            pens[key].setWidthF(width)
+        return pens[key]
+
+    def brush(self, cls, alpha):
+        """
+        @param cls: class name
+        @param alpha: alpha value replacing the alpha of the class color
+        @return: cached L{QBrush}, must not be modified
+        """
+        brushes = self.__brushes.setdefault(cls, {})
+        if alpha not in brushes:
+            color = QColor(self.color(cls))
+            color.setAlpha(alpha)
+            brushes[alpha] = QBrush(color)
+        return brushes[alpha]
+
+
 class VisWidget(QGraphicsView):
     plotPaletteChanged = pyqtSignal()
 
@@ -32,17 +94,42 @@ class VisWidget(QGraphicsView):
         super().__init__()
         self.setScene(QGraphicsScene())
         self.relation = None
+        self.selection = None
         self.plotPalette = None
+        self.styles = ClassStyleTable()
         self.setRenderHint(QPainter.Antialiasing)
 
-    def setRelation(self, rel: Relation):
+    def setRelation(self, rel: "data.Relation"):
         """
         Initialize widget with L{data.Relation}
         @param rel: data to be visualized
         """
+        if self.relation is not None:
+            self.relation.dataChanged.disconnect(self.updateWidget)
+        # clear a shared selection while its datasets are still shown, linked views see the new size right away
+        if self.selection is not None:
+            self.selection.resize(len(rel.dataMatrix()))
         self.relation = rel
         self.relation.dataChanged.connect(self.updateWidget)
 
+    def setSelection(self, selection: "data.Selection"):
+        """
+        Use a (possibly shared) L{data.Selection}. Linked views share one relation and one selection,
+        changes made in any of them are shown in all others.
+
+        @param selection: selection mask of the datasets of the relation
+        """
+        if self.selection is not None:
+            self.selection.changed.disconnect(self.updateSelectedItems)
+        self.selection = selection
+        self.selection.changed.connect(self.updateSelectedItems)
+
+    def setStyleTable(self, styles):
+        """
+        Share a L{ClassStyleTable} with other views.
+        """
+        self.styles = styles
+
     def setPlotPalette(self, paletteDict):
         """
         Set color palette for lines and points.
@@ -50,7 +137,46 @@ class VisWidget(QGraphicsView):
         @param paletteDict: dict with class names as keys and L{QColor} objects as values
         """
         self.plotPalette = paletteDict
+        self.styles.setColors(paletteDict)
         self.plotPaletteChanged.emit()
+        self.scene().update()
+
+    def setClassColor(self, cls, color):
+        """
+        Change the color of a single class. Only the style table entry and the items of this class are updated.
+
+        @param cls: class name
+        @param color: new L{QColor}
+        """
+        if self.plotPalette is not None:
+            self.plotPalette[cls] = color
+        self.styles.setColor(cls, color)
+        self.updateClassItems(cls)
+
+    def updateClassItems(self, cls):
+        """
+        Repaint all items of a class. Override this method in subclasses which can find these items
+        without repainting the whole scene.
+        """
+        self.scene().update()
+
+    def updateSelectedItems(self, changedIndices):
+        """
+        Called when the selection state of the given datasets has changed. Override this method in subclasses
+        which can find the items representing these datasets without repainting the whole scene.
+        """
+        self.scene().update()
+
+    def stopWorkers(self):
+        """
+        Stop background work of the view before it is destroyed. Override this method in subclasses which
+        start worker threads.
+        """
+        pass
+
+    def closeEvent(self, event):
+        self.stopWorkers()
+        super().closeEvent(event)
 
     def resizeEvent(self, event):
         if self.scene():
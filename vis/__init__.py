@@ -1,4 +1,5 @@
 from vis.StarPlot import StarPlot
+from vis.GlyphGrid import GlyphGrid
 from vis.VisWidget import VisWidget
 
-__all__ = ["VisWidget", "StarPlot"]
\ No newline at end of file
+__all__ = ["VisWidget", "StarPlot", "GlyphGrid"]
\ No newline at end of file